@@ -0,0 +1,241 @@
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+# Run without a window. Has to happen before pygame gets imported.
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# display.py loads its logos relative to the working directory
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import display
+import feed
+import routing
+
+# Headless benchmarks for routing, rendering and player feed ingest, on synthetic networks.
+# Prints one JSON object per result, so runs can be saved and compared.
+
+WAYPOINT_SPACING = 300 # Blocks between neighbouring synthetic waypoints
+WAYPOINT_TYPES = ("AirCS", "SQTR", "ClyRail", "SkyRail")
+
+def make_network(waypoint_count, seed=0):
+    """Builds a waypoints.json-style network: a jittered grid of waypoints, mostly connected to their neighbours"""
+    rng = random.Random(seed)
+    side = math.ceil(math.sqrt(waypoint_count))
+
+    data = {"waypoints": [], "lines": []}
+    ids = {}
+
+    for n in range(waypoint_count):
+        x, y = n % side, n // side
+        ids[(x, y)] = rng.getrandbits(63)
+
+        data["waypoints"].append({
+            "id": ids[(x, y)],
+            "type": WAYPOINT_TYPES[n % len(WAYPOINT_TYPES)],
+            "name": "Station %d" % n,
+            "pos": [
+                x * WAYPOINT_SPACING + rng.randint(-WAYPOINT_SPACING // 3, WAYPOINT_SPACING // 3),
+                y * WAYPOINT_SPACING + rng.randint(-WAYPOINT_SPACING // 3, WAYPOINT_SPACING // 3)
+            ]
+        })
+
+    for (x, y), w_id in ids.items():
+        # Rail to the right and down, the odd walkable diagonal
+        for dx, dy, line_type, chance in ((1, 0, 0, 0.8), (0, 1, 0, 0.8), (1, 1, 1, 0.1)):
+            other_id = ids.get((x + dx, y + dy))
+
+            if other_id is not None and rng.random() < chance:
+                data["lines"].append({"p1": w_id, "p2": other_id, "type": line_type})
+
+    return data
+
+def summarize(durations):
+    """Milliseconds statistics of a list of durations in seconds"""
+    durations = sorted(durations)
+
+    return {
+        "count": len(durations),
+        "mean_ms": statistics.fmean(durations) * 1000,
+        "p50_ms": durations[len(durations) // 2] * 1000,
+        "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+        "max_ms": durations[-1] * 1000
+    }
+
+def bench_routing(data, pair_count, rng, hierarchy=False):
+    start_time = time.perf_counter()
+    graph = routing.RoutingGraph(data)
+    build_time = time.perf_counter() - start_time
+
+    ids = [w["id"] for w in data["waypoints"]]
+    pairs = [rng.sample(ids, 2) for _ in range(pair_count)]
+
+    def time_queries(find_path):
+        durations = []
+        settled = []
+        found = 0
+
+        for start_id, end_id in pairs:
+            stats = {}
+
+            start_time = time.perf_counter()
+            path = find_path(start_id, end_id, stats)
+            durations.append(time.perf_counter() - start_time)
+
+            settled.append(stats["settled"])
+            found += path is not None
+
+        return {"found": found, "settled_mean": statistics.fmean(settled), **summarize(durations)}
+
+    results = {"build_ms": build_time * 1000, **time_queries(lambda start_id, end_id, stats: routing.find_path_a_star(graph, start_id, end_id, stats))}
+
+    if hierarchy:
+        start_time = time.perf_counter()
+        contraction_hierarchy = routing.build_contraction_hierarchy(graph)
+        build_time = time.perf_counter() - start_time
+
+        results["hierarchy"] = {"build_ms": build_time * 1000, **time_queries(lambda start_id, end_id, stats: routing.find_path_ch(graph, contraction_hierarchy, start_id, end_id, stats))}
+
+    return results
+
+def bench_rendering(data, frame_count):
+    display.data = data
+    display.rebuild_indexes()
+
+    positions = [w["pos"] for w in data["waypoints"]]
+    center = (statistics.fmean(p[0] for p in positions), statistics.fmean(p[1] for p in positions))
+    corner = (min(p[0] for p in positions), min(p[1] for p in positions))
+
+    results = []
+
+    for camera_name, (camera_x, camera_y) in (("center", center), ("corner", corner)):
+        for step in sorted({*range(0, display.ZOOM_STEPS, 4), display.LOD_ZOOM_STEP, display.ZOOM_STEPS - 1}):
+            display.camera_x, display.camera_y = camera_x, camera_y
+            display.camera_zoom_step = step
+            display.camera_zoom = display.zoom_from_step(step)
+
+            # Frames that have to redraw the static layer (zoom, edit, reload)...
+            redraw_durations = []
+
+            for _ in range(frame_count):
+                display.static_layer_dirty = True
+
+                start_time = time.perf_counter()
+                display.draw_frame()
+                redraw_durations.append(time.perf_counter() - start_time)
+
+            # ...and frames that can reuse it
+            cached_durations = []
+
+            for _ in range(frame_count):
+                start_time = time.perf_counter()
+                display.draw_frame()
+                cached_durations.append(time.perf_counter() - start_time)
+
+            results.append({"camera": camera_name, "zoom_step": step, "redraw": summarize(redraw_durations), "cached": summarize(cached_durations)})
+
+    return results
+
+def bench_editing(data, edit_count, rng):
+    display.data = data
+    display.rebuild_indexes()
+
+    ids = [w["id"] for w in data["waypoints"]]
+    durations = []
+
+    # Remove random lines and put them back, like right clicking and side clicking in display.py
+    for _ in range(edit_count):
+        l = rng.choice(data["lines"])
+
+        start_time = time.perf_counter()
+        display.remove_line(l)
+        display.add_line({"p1": l["p1"], "p2": l["p2"], "type": l["type"]})
+        durations.append(time.perf_counter() - start_time)
+
+    # And waypoints, with all their lines
+    for _ in range(edit_count):
+        w = display.find_waypoint_by_id(rng.choice(ids))
+        lines = display.network_index.find_lines_of(w["id"])
+
+        start_time = time.perf_counter()
+        display.remove_waypoint(w["id"])
+        display.add_waypoint(w)
+
+        for l in lines:
+            display.add_line(l)
+
+        durations.append(time.perf_counter() - start_time)
+
+    return summarize(durations)
+
+def bench_ingest(player_count, seconds):
+    # Generate the messages up front, so only the ingest itself is timed
+    messages = [message for _, message in feed.synthesize_recording(player_count, seconds)]
+    player_feed = feed.PlayerFeed()
+
+    # What the websocket thread does for every message
+    start_time = time.perf_counter()
+
+    for message in messages:
+        player_feed.push(json.loads(message))
+
+    push_time = time.perf_counter() - start_time
+
+    # What the render loop does once per frame
+    start_time = time.perf_counter()
+    display.player_feed = player_feed
+    display.update_players()
+    swap_time = time.perf_counter() - start_time
+
+    return {
+        "messages": len(messages),
+        "messages_per_second": len(messages) / push_time,
+        "push_ms": push_time * 1000,
+        "swap_ms": swap_time * 1000,
+        "superseded": player_feed.superseded
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark routing, rendering and player feed ingest without a window")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="numbers of waypoints in the synthetic networks")
+    parser.add_argument("--pairs", type=int, default=200, help="random routes to find per network")
+    parser.add_argument("--hierarchy", action="store_true", help="also build a contraction hierarchy and route with it (slow to build on big networks)")
+    parser.add_argument("--frames", type=int, default=10, help="frames to draw per camera position and zoom step")
+    parser.add_argument("--players", type=int, default=1000, help="fake players for the ingest benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--edits", type=int, default=200, help="line and waypoint edits to time per network")
+    parser.add_argument("--skip", choices=("routing", "rendering", "editing", "ingest"), nargs="*", default=[])
+    parser.add_argument("--output", type=argparse.FileType("a"), default=sys.stdout, help="file to append results to")
+    args = parser.parse_args()
+
+    def emit(result):
+        args.output.write(json.dumps(result) + "\n")
+        args.output.flush()
+
+    display.init_window()
+
+    for size in args.sizes:
+        data = make_network(size, args.seed)
+        network_info = {"waypoints": len(data["waypoints"]), "lines": len(data["lines"])}
+
+        if "routing" not in args.skip:
+            emit({"benchmark": "routing", **network_info, **bench_routing(data, args.pairs, random.Random(args.seed), args.hierarchy)})
+
+        if "rendering" not in args.skip:
+            for result in bench_rendering(data, args.frames):
+                emit({"benchmark": "rendering", **network_info, **result})
+
+        if "editing" not in args.skip:
+            emit({"benchmark": "editing", **network_info, **bench_editing(data, args.edits, random.Random(args.seed))})
+
+    if "ingest" not in args.skip:
+        emit({"benchmark": "ingest", "players": args.players, **bench_ingest(args.players, 10)})
+
+if __name__ == "__main__":
+    main()
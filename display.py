@@ -1,9 +1,21 @@
+import concurrent.futures
+import functools
 import json
 import pygame
 import math
+import os
 import threading
-import websocket
-import rel
+import time
+
+import feed
+import geometry
+import network
+import network_file
+import profiling
+import routing
+import saving
+import search
+import spatial
 
 # PYGAME INIT
 
@@ -15,27 +27,106 @@ pygame.font.init()
 SIZE = WIDTH, HEIGHT = 800, 600
 FPS = 60
 
+BACKGROUND_COLOR = (36, 34, 31)
+
 # GLOBAL CONSTANTS
 
-WS_URL = "ws://bnbnav.aircs.racing/ws"
-PATH = "waypoints.json"
+WS_URL = os.environ.get("WS_URL", "ws://bnbnav.aircs.racing/ws")
+
+# Player feed sources other than WS_URL, for testing. See the README.
+FEED_RECORD = os.environ.get("FEED_RECORD") # Also append the live feed to this file
+FEED_REPLAY = os.environ.get("FEED_REPLAY") # Replay this recording instead of the live feed
+FEED_REPLAY_SPEED = os.environ.get("FEED_REPLAY_SPEED", "1") # Multiplier, or "max"
+FEED_SYNTHETIC_PLAYERS = int(os.environ.get("FEED_SYNTHETIC_PLAYERS", "0")) # Replay this many fake players instead of the live feed
+FEED_SYNTHETIC_SECONDS = 3600
+PATH = os.environ.get("WAYPOINTS_PATH", "waypoints.json") # Or a .wpnet file made with network_file.py, which loads much faster
 FONT = pygame.font.SysFont("Noto Sans", 12)
+HUD_FONT = pygame.font.SysFont("monospace", 12)
+
+PROFILE_TRACE = os.environ.get("PROFILE_TRACE") # Write per-frame timings to this file (.csv, or JSON lines otherwise)
 
 WAYPOINT_SIZE = 10
 WAYPOINT_SIZE_MIN = 12
 
+SPATIAL_CELL_SIZE = 512 # In blocks
+
+PLAYER_GLIDE_TIME_MAX = 1 # Seconds a player takes at most to glide to its new position. See geometry.PlayerTracks.
+PLAYER_TELEPORT_DISTANCE = 64 # Blocks a player has to move at once to jump there instead
+
 # GLOBALS
 
 data = {}
-players = {}
+players = {} # Player name -> (x, z), swapped in from player_feed every frame
 last_path = []
 
+network_index = None
+routing_graph = None
+travel_time_graph = None # Same network, priced in seconds with transfer penalties. See routing.TravelTimeProfile. Built when first needed.
+cost_matrix = None # routing.CostMatrix precomputed by routing.py, while it still matches the network
+hierarchy = None # routing.ContractionHierarchy precomputed by routing.py, same
+
+name_index = None # search.NameIndex of the waypoints, None until it's built in the background after loading
+name_index_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+name_index_future = None # Of the NameIndex being built on name_index_pool, from a copy of the waypoint list
+name_index_edits = [] # (method, args) of the edits since that copy, for it to catch up on
+
+network_arrays = None
+lod_clusters = {} # Zoom step -> geometry.Clusters
+lod_clusters_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1) # The zoomed-out steps get their clusters here after loading
+lod_clusters_pending = {} # Zoom step -> future of its Clusters, made from a snapshot of network_arrays
+lod_clusters_edits = [] # (method, args) of the edits since that snapshot, for the pending clusters to catch up on
+player_grid = spatial.SpatialGrid(SPATIAL_CELL_SIZE) # Where the feed last put every player
+player_tracks = geometry.PlayerTracks(PLAYER_GLIDE_TIME_MAX, PLAYER_TELEPORT_DISTANCE) # Where they're drawn
+player_feed = feed.PlayerFeed()
+feed_source = None
+
+saver = None # saving.BackgroundSaver of PATH, None when edits shouldn't be saved at all
+unsaved_edits = [] # Journal entries not handed to saver yet
+last_autosave = 0 # pygame.time.get_ticks() of the last autosave
+
+# PYGAME GLOBALS (set by init_window)
+
+screen = None
+clock = None
+
+logo_aircs   = None
+logo_sqtr    = None
+logo_clyrail = None
+
+# PROFILER GLOBALS
+
+frame_profiler = profiling.FrameProfiler(PROFILE_TRACE)
+
+# RENDERING GLOBALS
+
+static_layer = None
+static_layer_camera = None # (camera_x, camera_y, camera_zoom) the static layer was drawn at
+static_layer_dirty = True
+
 # CAMERA CONSTANTS
 
 MIN_ZOOM = 0.01
 MAX_ZOOM = 5
 ZOOM_STEPS = 20
 
+# CACHE CONSTANTS
+
+LOGO_CACHE_SIZE = 128
+PREWARM_LOGO_CACHE = True
+
+LABEL_CACHE_SIZE = 4096
+LABEL_ALPHA = 192
+
+STATIC_LAYER_MARGIN = 256 # Extra pixels drawn on each side, so panning a bit doesn't need a redraw
+
+# LEVEL OF DETAIL CONSTANTS
+
+LOD_ZOOM_STEP = 6 # Zoom steps below this one draw clusters instead of every waypoint
+LOD_CLUSTER_PIXELS = 32 # Size of the on-screen grid waypoints get merged on
+LOD_CLUSTER_COLOR = (73, 216, 235)
+
+LABEL_GRID_SIZE = 16 # Size of a cell in the grid labels can't overlap on, in pixels
+
 # CAMERA GLOBALS
 
 moving_camera = False
@@ -53,66 +144,393 @@ SELECTION_WIDTH = 5
 # SELECTION GLOBALS
 selected_waypoint = None
 
+# ROUTE PREVIEW CONSTANTS
+
+ROUTE_PREVIEW_COLORS = ((235, 220, 60), (235, 150, 50), (190, 100, 200)) # Best route first
+
+# ROUTE PREVIEW GLOBALS
+
+route_preview = [] # (cost, path) routes from the selected waypoint to the one under the mouse, best first
+route_preview_key = None # What route_preview was found for
+route_preview_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1) # Routes are searched for here, so hovering never holds up a frame
+route_preview_future = None # Search running on route_preview_pool
+route_preview_future_key = None # What it's for, like route_preview_key
+route_preview_cancel = threading.Event() # Stops the search on route_preview_pool
+
+# SEARCH CONSTANTS
+
+SEARCH_ZOOM_STEP = LOD_ZOOM_STEP + 4 # Jumping to a search result zooms in at least this far
+SEARCH_COLOR = (255, 255, 255)
+SEARCH_CHOICE_COLOR = (73, 216, 235)
+
+# SEARCH GLOBALS
+
+name_search = None # search.Search while the search box is open
+search_query = ""
+search_results = [] # Waypoint IDs, best first
+search_choice = 0 # Index in search_results
+
 # FLAGS
 show_labels = True
 show_players = True
 show_debug_ids = False
+fastest_routes = False # Route by travel time instead of distance
+
+# USEFUL FUNCTIONS
 
-# USEFUL CLASSES
-class Node:
-    """Internal node class for A* pathfinding"""
+def load_waypoints():
+    global data
+    columns = None
 
-    def __init__(self, node_id):
-        self.node_id = node_id
+    if PATH.endswith(network_file.EXTENSION):
+        columns = network_file.load(PATH)
+        data = columns.to_data()
 
-        self.parent = None
+        # The arrays can only stand in for data if every waypoint and line fit in them
+        if columns.irregular_waypoints or columns.irregular_lines:
+            columns = None
+    else:
+        with open(PATH, "r") as f:
+            data = json.load(f)
 
-        self.g = 0 # Estimated distance from end
-        self.h = 0 # Distance from start
-        self.f = 0 # Cost of the node
+    # Edits made since the file was last written in full
+    journal_entries = saving.replay_journal(data, PATH)
 
-    def __eq__(self, other):
-        return self.node_id == other.node_id
+    if journal_entries:
+        columns = None
 
-    def __lt__(self, other):
-        return self.f < other.f
+    if saver is not None:
+        saver.journal_entries = journal_entries
 
-    def __gt__(self, other):
-        return self.f > other.f
+    global cost_matrix
+    try:
+        cost_matrix = routing.CostMatrix.load(routing.cost_matrix_path(PATH))
+    except FileNotFoundError:
+        cost_matrix = None
 
-    def __le__(self, other):
-        return self.f <= other.f
+    global hierarchy
+    try:
+        hierarchy = routing.ContractionHierarchy.load(routing.hierarchy_path(PATH))
+    except FileNotFoundError:
+        hierarchy = None
 
-    def __ge__(self, other):
-        return self.f >= other.f
+    rebuild_indexes(columns)
 
-    def __repr__(self):
-        return "Node(%d)" % self.node_id
+def rebuild_indexes(columns=None):
+    """Rebuilds everything derived from data, after it was replaced. columns is a network_file.NetworkFile of data, to build some of it faster"""
+    global network_index
+    network_index = network.NetworkIndex(data, columns)
 
-# USEFUL FUNCTIONS
+    global name_index, name_index_future
+    name_index = None
 
-def load_waypoints():
-    global data
-    with open(PATH, "r") as f:
-        data = json.load(f)
+    if name_index_future is not None:
+        name_index_future.cancel()
+
+    name_index_edits.clear()
+    # Straight from the columns, if there are any, so the waypoints are only built when something looks at them
+    name_index_future = name_index_pool.submit(search.NameIndex, columns.waypoint_names() if columns is not None else data["waypoints"].copy())
+
+    rebuild_routing_graph(columns)
+    rebuild_network_arrays(columns)
+
+    global static_layer_dirty
+    static_layer_dirty = True
+
+def rebuild_routing_graph(columns=None):
+    global routing_graph, travel_time_graph
+    routing_graph = routing.RoutingGraph(data, columns=columns)
+    travel_time_graph = None
+
+    # Any edit to the lines makes the precomputed costs wrong, run routing.py again to bring them back
+    global cost_matrix
+    if cost_matrix is not None and cost_matrix.fingerprint != routing_graph.fingerprint():
+        cost_matrix = None
+
+    global hierarchy
+    if hierarchy is not None and hierarchy.fingerprint != routing_graph.fingerprint():
+        hierarchy = None
+
+    routing_graph.hierarchy = hierarchy
+
+def rebuild_network_arrays(columns=None):
+    global network_arrays
+    network_arrays = geometry.NetworkArrays(data, columns)
+
+    # Clusters of every zoomed-out step are computed in the background, the step the camera is on first
+    lod_clusters.clear()
+
+    for future in lod_clusters_pending.values():
+        future.cancel()
+
+    lod_clusters_pending.clear()
+    lod_clusters_edits.clear()
+
+    snapshot = network_arrays.snapshot()
+
+    for step in sorted(range(LOD_ZOOM_STEP), key=lambda step: step != camera_zoom_step):
+        lod_clusters_pending[step] = lod_clusters_pool.submit(geometry.Clusters, snapshot, get_lod_cell_size(step))
+
+def get_lod_cell_size(step):
+    return LOD_CLUSTER_PIXELS / zoom_from_step(step)
+
+def collect_lod_clusters(wait_for_step=None):
+    """Takes in the clusters that were computed in the background, waiting for wait_for_step's if it's still pending"""
+    for step, future in list(lod_clusters_pending.items()):
+        if step == wait_for_step or future.done():
+            clusters = future.result()
+
+            for method, args in lod_clusters_edits:
+                getattr(clusters, method)(*args)
+
+            lod_clusters[step] = clusters
+            del lod_clusters_pending[step]
+
+    if not lod_clusters_pending:
+        lod_clusters_edits.clear()
+
+def get_lod_clusters(step):
+    collect_lod_clusters(step)
+
+    # Zoomed out further than the steps computed in the background
+    if step not in lod_clusters:
+        lod_clusters[step] = geometry.Clusters(network_arrays, get_lod_cell_size(step))
+
+    return lod_clusters[step]
+
+def edit_lod_clusters(method, *args):
+    """Applies an edit to the clusters, now or once they're computed"""
+    for clusters in lod_clusters.values():
+        getattr(clusters, method)(*args)
+
+    if lod_clusters_pending:
+        lod_clusters_edits.append((method, args))
+
+# EDITING, without rebuilding anything. Every structure derived from data is updated in place.
+
+def add_waypoint(w):
+    record_edit({"op": "add_waypoint", "waypoint": w})
+    cancel_route_preview_search()
+
+    network_index.add_waypoint(w)
+    network_arrays.add_waypoint(w)
+    routing_graph.add_waypoint(w)
+
+    edit_lod_clusters("add_waypoint", network_arrays.index[w["id"]], w["pos"])
+
+    if travel_time_graph is not None:
+        travel_time_graph.add_waypoint(w)
+
+    edit_name_index("add_waypoint", w)
+
+    network_edited()
+
+def remove_waypoint(w_id):
+    global selected_waypoint
+
+    for l in network_index.find_lines_of(w_id):
+        remove_line(l)
+
+    record_edit({"op": "remove_waypoint", "id": w_id})
+    cancel_route_preview_search()
+
+    edit_lod_clusters("remove_waypoint", network_arrays.index[w_id], find_waypoint_by_id(w_id)["pos"])
+
+    network_index.remove_waypoint(find_waypoint_by_id(w_id))
+    network_arrays.remove_waypoint(w_id)
+    routing_graph.remove_waypoint(w_id)
+
+    if travel_time_graph is not None:
+        travel_time_graph.remove_waypoint(w_id)
+
+    edit_name_index("remove_waypoint", w_id)
+
+    if selected_waypoint == w_id:
+        selected_waypoint = None
+
+    network_edited()
+    repair_last_path(lambda path: w_id not in path)
+
+def add_line(l):
+    record_edit({"op": "add_line", "line": l})
+    cancel_route_preview_search()
+
+    network_index.add_line(l)
+    rows = network_arrays.add_line(l)
+    routing_graph.add_line(l)
+
+    if rows is not None:
+        edit_lod_clusters("add_line", *rows, l["type"])
+
+    if travel_time_graph is not None:
+        travel_time_graph.add_line(l)
+
+    network_edited()
+
+    graph = get_route_graph()
+    ends = graph.line_ends(l)
+    repair_last_path(lambda path: ends is None or not routing.line_may_shorten(graph, path, *ends))
+
+def remove_line(l):
+    record_edit({"op": "remove_line", "p1": l["p1"], "p2": l["p2"], "type": l["type"]})
+    cancel_route_preview_search()
+
+    network_index.remove_line(l)
+    rows = network_arrays.remove_line(l)
+    routing_graph.remove_line(l)
+
+    if rows is not None:
+        edit_lod_clusters("remove_line", *rows, l["type"])
+
+    if travel_time_graph is not None:
+        travel_time_graph.remove_line(l)
+
+    network_edited()
+    repair_last_path(lambda path: not routing.path_uses_line(path, l["p1"], l["p2"]))
+
+def network_edited():
+    global cost_matrix, hierarchy, route_preview_key, static_layer_dirty
+
+    # Precomputed routing data can't be patched, run routing.py again to bring it back
+    cost_matrix = None
+    hierarchy = None
+
+    route_preview_key = None
+    static_layer_dirty = True
+
+    # Waypoints may have come or gone
+    if name_search is not None:
+        open_search(search_query)
+
+def repair_last_path(keep_path):
+    """Finds last_path again, unless keep_path(last_path) says the edit can't have changed it"""
+    global last_path
+
+    if last_path and not keep_path(last_path):
+        last_path = find_path_a_star(last_path[0], last_path[-1]) or []
+
+def record_edit(entry):
+    if saver is not None:
+        unsaved_edits.append(entry)
+
+# SAVING, on saver's thread. Edits go to the journal every AUTOSAVE_INTERVAL seconds, the whole network is only written now and then.
+
+def autosave(force=False):
+    """Hands unsaved edits to saver, if it's been long enough since the last time"""
+    global last_autosave
+
+    if saver is None or not unsaved_edits:
+        return
+
+    if not force and pygame.time.get_ticks() - last_autosave < saving.AUTOSAVE_INTERVAL * 1000:
+        return
+
+    saver.append(unsaved_edits)
+    unsaved_edits.clear()
+    last_autosave = pygame.time.get_ticks()
+
+    if saver.journal_entries >= saving.JOURNAL_COMPACT_EDITS:
+        save_waypoints()
 
 def save_waypoints():
-    with open(PATH, "w") as f:
-        json.dump(data, f, indent=4)
+    """Writes the whole network in the background and empties the journal"""
+    # Journal the edits first, so they're safe even if writing the network fails
+    autosave(force=True)
 
-def find_waypoint_by_id(w_id):
-    return tuple(filter(lambda x: x["id"] == w_id, data["waypoints"]))[0]
+    # Edits only add and remove waypoints and lines, they never change them, so copying the lists is enough
+    saver.compact({**data, "waypoints": data["waypoints"].copy(), "lines": data["lines"].copy()})
 
-def find_line_by_ids(w1_id, w2_id):
-    s1 = {w1_id, w2_id}
+# SEARCH
+
+def open_search(query=""):
+    """Opens the search box, or starts the search in it again (after name_index changed)"""
+    global name_search
+
+    if name_search is None:
+        pygame.key.start_text_input()
+
+    # Nothing is found until the index is built, then the search starts again
+    name_search = search.Search(name_index if name_index is not None else search.NameIndex([]))
+    update_search(query)
+
+def collect_name_index():
+    """Takes in the name index once it's built in the background"""
+    global name_index, name_index_future
+
+    if name_index_future is None or not name_index_future.done():
+        return
+
+    name_index = name_index_future.result()
+    name_index_future = None
+
+    for method, args in name_index_edits:
+        getattr(name_index, method)(*args)
+
+    name_index_edits.clear()
+
+    if name_search is not None:
+        open_search(search_query)
+
+def edit_name_index(method, *args):
+    """Applies an edit to the name index, now or once it's built"""
+    if name_index is not None:
+        getattr(name_index, method)(*args)
+    elif name_index_future is not None:
+        name_index_edits.append((method, args))
+
+def close_search():
+    global name_search
 
-    for l in data["lines"]:
-        s2 = {l["p1"], l["p2"]}
+    name_search = None
+    pygame.key.stop_text_input()
 
-        if s1 == s2:
-            return l
+def update_search(query):
+    global search_query, search_results, search_choice
 
-    return None
+    search_query = query
+    search_results = name_search.update(query)
+    search_choice = 0
+
+def jump_to_search_result(route_there):
+    """Moves the camera to the chosen search result and selects it, after finding the route to it from the selected waypoint if route_there"""
+    global camera_x, camera_y, camera_zoom, camera_zoom_step, selected_waypoint, last_path
+
+    if not search_results:
+        return
+
+    w = find_waypoint_by_id(search_results[search_choice])
+
+    if route_there and selected_waypoint is not None:
+        last_path = find_path_a_star(selected_waypoint, w["id"]) or []
+
+    camera_x, camera_y = w["pos"]
+    camera_zoom_step = max(camera_zoom_step, SEARCH_ZOOM_STEP)
+    camera_zoom = zoom_from_step(camera_zoom_step)
+
+    selected_waypoint = w["id"]
+
+    close_search()
+
+def handle_search_key(event):
+    """Keys go to the search box while it's open, instead of being shortcuts"""
+    global search_choice
+
+    if event.key == pygame.K_ESCAPE:
+        close_search()
+    elif event.key == pygame.K_BACKSPACE:
+        update_search(search_query[:-1])
+    elif event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+        jump_to_search_result(bool(event.mod & pygame.KMOD_SHIFT))
+    elif event.key == pygame.K_DOWN and search_results:
+        search_choice = (search_choice + 1) % len(search_results)
+    elif event.key == pygame.K_UP and search_results:
+        search_choice = (search_choice - 1) % len(search_results)
+
+def find_waypoint_by_id(w_id):
+    return network_index.waypoints[w_id]
+
+def find_line_by_ids(w1_id, w2_id):
+    return network_index.find_line(w1_id, w2_id)
 
 def apply_camera(x, y):
     return (
@@ -123,6 +541,52 @@ def apply_camera(x, y):
 def apply_camera_zoom(r):
     return r * camera_zoom
 
+def zoom_from_step(step):
+    log_min_zoom = math.log(MIN_ZOOM)
+    log_max_zoom = math.log(MAX_ZOOM)
+    log_zoom = log_min_zoom + (log_max_zoom - log_min_zoom) * step / (ZOOM_STEPS - 1)
+    return math.exp(log_zoom)
+
+def get_waypoint_scale_pixels(zoom):
+    return clamp(WAYPOINT_SIZE * zoom, WAYPOINT_SIZE_MIN, float("inf"))
+
+@functools.lru_cache(maxsize=LOGO_CACHE_SIZE)
+def get_scaled_logo(logo, size):
+    """Returns the logo scaled to a square of size pixels. Only rescales the first time a size is asked for"""
+    return pygame.transform.scale(logo, (size, size)).convert_alpha()
+
+@functools.lru_cache(maxsize=LABEL_CACHE_SIZE)
+def get_label(text, fg, bg):
+    """Returns a translucent text surface. Only renders the first time a label is asked for"""
+    text_surface = FONT.render(text, True, fg, bg).convert_alpha()
+    text_surface.set_alpha(LABEL_ALPHA)
+    return text_surface
+
+def get_waypoint_label(w):
+    # The debug ID is part of the text, so toggling it gets its own cache entries
+    return get_label(f" {w['name']} {tuple(w['pos'])}{' ' + str(w['id']) if show_debug_ids else ''} ", (255, 255, 255), (0, 0, 0))
+
+def claim_label_space(rect, taken_cells):
+    """Takes the cells of the label grid under rect, unless another label got any of them first"""
+    cells = [
+        (x, y)
+        for x in range(rect.left // LABEL_GRID_SIZE, rect.right // LABEL_GRID_SIZE + 1)
+        for y in range(rect.top // LABEL_GRID_SIZE, rect.bottom // LABEL_GRID_SIZE + 1)
+    ]
+
+    if any(cell in taken_cells for cell in cells):
+        return False
+
+    taken_cells.update(cells)
+    return True
+
+def get_camera_world_rect(margin_pixels=0):
+    """Returns the part of the world that's on screen as (min_x, min_y, max_x, max_y)"""
+    half_width  = (WIDTH  / 2 + margin_pixels) / camera_zoom
+    half_height = (HEIGHT / 2 + margin_pixels) / camera_zoom
+
+    return (camera_x - half_width, camera_y - half_height, camera_x + half_width, camera_y + half_height)
+
 def clamp(n, smallest, largest):
     return max(smallest, min(n, largest))
 
@@ -132,305 +596,341 @@ def point_circle_collision(point_x, point_y, circle_x, circle_y, circle_r):
 def point_rect_collision(point_x, point_y, rect_x, rect_y, rect_w, rect_h):
     return point_x >= rect_x and point_x <= rect_x + rect_w and point_y >= rect_y and point_y <= rect_y + rect_h
 
-def line_rect_collision(line_x1, line_y1, line_x2, line_y2, rect_x, rect_y, rect_w, rect_h):
-    def line_line_collision(line1_x1, line1_y1, line1_x2, line1_y2, line2_x1, line2_y1, line2_x2, line2_y2):
-        u_a = ((line2_x2 - line2_x1) * (line1_y1 - line2_y1) - (line2_y2 - line2_y1) * (line1_x1 - line2_x1)) / ((line2_y2 - line2_y1) * (line1_x2 - line1_x1) - (line2_x2 - line2_x1) * (line1_y2 - line1_y1))
-        u_b = ((line1_x2 - line1_x1) * (line1_y1 - line2_y1) - (line1_y2 - line1_y1) * (line1_x1 - line2_x1)) / ((line2_y2 - line2_y1) * (line1_x2 - line1_x1) - (line2_x2 - line2_x1) * (line1_y2 - line1_y1))
+def get_waypoint_under_point(point_x, point_y):
+    half_size = get_waypoint_scale_pixels(camera_zoom) / 2
 
-        return 0 <= u_a <= 1 and 0 <= u_b <= 1
-    try:
-        left   = line_line_collision(line_x1, line_y1, line_x2, line_y2, rect_x,          rect_y,          rect_x,          rect_y + rect_h)
-        right  = line_line_collision(line_x1, line_y1, line_x2, line_y2, rect_x + rect_w, rect_y,          rect_x + rect_w, rect_y + rect_h)
-        top    = line_line_collision(line_x1, line_y1, line_x2, line_y2, rect_x,          rect_y,          rect_x + rect_w, rect_y)
-        bottom = line_line_collision(line_x1, line_y1, line_x2, line_y2, rect_x,          rect_y + rect_h, rect_x + rect_w, rect_y + rect_h)
-    except ZeroDivisionError:
-        return False
+    # Check every waypoint at once, in screen space
+    waypoint_camera_positions = geometry.apply_camera(network_arrays.positions, camera_x, camera_y, camera_zoom, WIDTH, HEIGHT)
+    hits = geometry.points_in_rect(waypoint_camera_positions, point_x - half_size, point_y - half_size, point_x + half_size, point_y + half_size).nonzero()[0]
 
-    # That was really painful to write
+    if len(hits) > 0:
+        return network_arrays.waypoints[hits[0]]
 
-    return left or right or top or bottom
+def get_route_graph():
+    global travel_time_graph
 
-def get_waypoint_under_point(point_x, point_y):
-    for w in data["waypoints"]:
-        waypoint_camera_pos = apply_camera(w["pos"][0], w["pos"][1])
-        waypoint_camera_scale_pixels = clamp(apply_camera_zoom(WAYPOINT_SIZE), WAYPOINT_SIZE_MIN, float("inf"))
-        if point_rect_collision(point_x, point_y, waypoint_camera_pos[0] - waypoint_camera_scale_pixels / 2, waypoint_camera_pos[1] - waypoint_camera_scale_pixels / 2, waypoint_camera_scale_pixels, waypoint_camera_scale_pixels):
-            return w
+    if not fastest_routes:
+        return routing_graph
+
+    if travel_time_graph is None:
+        travel_time_graph = routing.RoutingGraph(data, routing.TravelTimeProfile())
+
+    return travel_time_graph
 
 def find_path_a_star(start_waypoint_id, end_waypoint_id):
-    # Create start and end nodes
-    start_node = Node(start_waypoint_id)
-    end_node = Node(end_waypoint_id)
-    
-    # Get end waypoint. We'll need it later!
-    end_waypoint = find_waypoint_by_id(end_waypoint_id)
-    
-    open_list = []
-    closed_list = []
+    return routing.find_route(get_route_graph(), start_waypoint_id, end_waypoint_id)
+
+def find_nearest_of_type(start_waypoint_id, waypoint_type):
+    """Returns the ID of the closest waypoint of a type by travel cost, or None"""
+    target_ids = [w["id"] for w in data["waypoints"] if w["type"] == waypoint_type]
+
+    # The precomputed costs are distances
+    if cost_matrix is not None and not fastest_routes:
+        nearest = cost_matrix.nearest(start_waypoint_id, target_ids)
+        return nearest[0] if nearest is not None else None
+
+    # No precomputed costs, one Dijkstra from the start does the job too
+    graph = get_route_graph()
+    costs = routing.dijkstra(graph, graph.index[start_waypoint_id])
+    target_ids = [w_id for w_id in target_ids if w_id != start_waypoint_id and costs[graph.index[w_id]] < math.inf]
+
+    return min(target_ids, key=lambda w_id: costs[graph.index[w_id]], default=None)
+
+def draw_static_layer():
+    """Draws the lines, waypoints and labels around the camera onto the static layer"""
+    global static_layer, static_layer_camera, static_layer_dirty
+
+    layer_width  = WIDTH  + STATIC_LAYER_MARGIN * 2
+    layer_height = HEIGHT + STATIC_LAYER_MARGIN * 2
+
+    if static_layer is None:
+        static_layer = pygame.Surface((layer_width, layer_height)).convert()
+
+    static_layer.fill(BACKGROUND_COLOR)
+
+    if camera_zoom_step < LOD_ZOOM_STEP:
+        draw_clusters(get_lod_clusters(camera_zoom_step), layer_width, layer_height)
+    else:
+        draw_network(layer_width, layer_height)
+
+    static_layer_camera = (camera_x, camera_y, camera_zoom)
+    static_layer_dirty = False
+
+def draw_lines(positions, line_endpoints, line_types, layer_width, layer_height):
+    # All the points on the layer, as layer coordinates
+    camera_positions = geometry.apply_camera(positions, camera_x, camera_y, camera_zoom, layer_width, layer_height).tolist()
+
+    line_starts = positions[line_endpoints[:, 0]]
+    line_ends   = positions[line_endpoints[:, 1]]
+    line_width  = int(clamp(apply_camera_zoom(5), 2, float("inf")))
+
+    visible_lines = geometry.segments_in_rect(line_starts, line_ends, *get_camera_world_rect(STATIC_LAYER_MARGIN)).nonzero()[0]
+
+    for (i, j), line_type in zip(line_endpoints[visible_lines].tolist(), line_types[visible_lines].tolist()):
+        pygame.draw.line(static_layer, (255, 255, 255) if line_type == 0 else (128, 128, 128), camera_positions[i], camera_positions[j], width=line_width)
+
+    frame_profiler.count("lines drawn", len(visible_lines))
+    frame_profiler.count("lines culled", len(line_endpoints) - len(visible_lines))
+    frame_profiler.mark("lines")
+
+    return camera_positions
+
+def draw_waypoint(w, waypoint_camera_pos, waypoint_camera_scale_pixels):
+    #color = (212, 64, 44)  if w["type"] == "AirCS"   else (
+    #        (55, 66, 219)  if w["type"] == "SQTR"    else (
+    #        (73, 216, 235) if w["type"] == "SkyRail" else (
+    #        (237, 227, 26) if w["type"] == "ClyRail" else (255, 255, 255))))
+
+    logo_to_use = logo_aircs   if w["type"] == "AirCS"   else (
+                  logo_sqtr    if w["type"] == "SQTR"    else (
+                  logo_clyrail if w["type"] == "ClyRail" else None))
+
+    if logo_to_use is not None:
+        static_layer.blit(
+            get_scaled_logo(logo_to_use, int(waypoint_camera_scale_pixels)),
+            (
+                waypoint_camera_pos[0] - waypoint_camera_scale_pixels / 2,
+                waypoint_camera_pos[1] - waypoint_camera_scale_pixels / 2
+            )
+        )
+    else:
+        pygame.draw.circle(
+            static_layer,
+            (73, 216, 235),#color,
+            waypoint_camera_pos,
+            waypoint_camera_scale_pixels // 2,
+            int(clamp(apply_camera_zoom(5), 2, float("inf")))
+        )
+
+def draw_network(layer_width, layer_height):
+    # RENDER LINES
+    waypoint_camera_positions = draw_lines(network_arrays.positions, network_arrays.line_endpoints, network_arrays.line_types, layer_width, layer_height)
 
-    # Add the start node to the open list
-    open_list.append(start_node)
+    # RENDER WAYPOINTS
+    waypoint_camera_scale_pixels = get_waypoint_scale_pixels(camera_zoom)
 
-    # Loop until no nodes left
-    while len(open_list) > 0:
-        # Get node with lowest cost in open list
-        current_node = min(open_list)
-        current_index = open_list.index(current_node)
-        
-        # Pop current node off the open list, and add it to the closed list.
-        open_list.pop(current_index)
-        closed_list.append(current_node)
+    visible_waypoints = geometry.points_in_rect(network_arrays.positions, *get_camera_world_rect(STATIC_LAYER_MARGIN + waypoint_camera_scale_pixels)).nonzero()[0].tolist()
 
-        # Have we found the goal yet?
-        if current_node == end_node:
-            # We have! Let's backtrack.
-            path = []
+    for iw in visible_waypoints:
+        draw_waypoint(network_arrays.waypoints[iw], waypoint_camera_positions[iw], waypoint_camera_scale_pixels)
 
-            current = current_node
+    frame_profiler.count("waypoints drawn", len(visible_waypoints))
+    frame_profiler.count("waypoints culled", len(network_arrays.index) - len(visible_waypoints))
+    frame_profiler.mark("waypoints")
 
-            while current is not None:
-                path.append(current.node_id)
-                current = current.parent
-            
-            #print(open_list, closed_list)
+    # RENDER LABELS
+    if show_labels:
+        for iw in visible_waypoints:
+            waypoint_camera_pos = waypoint_camera_positions[iw]
+            static_layer.blit(get_waypoint_label(network_arrays.waypoints[iw]), (waypoint_camera_pos[0] + 6, waypoint_camera_pos[1] + 6))
 
-            return path[::-1] # We backtracked. Reverse the path to get the forward-track.
+    frame_profiler.mark("labels")
 
-        # Find the children
-        children = []
-        
-        for l in data["lines"]:
-            # Sets are swag.
-            point_set = {l["p1"], l["p2"]}
+def draw_clusters(clusters, layer_width, layer_height):
+    # RENDER LINES
+    cluster_camera_positions = draw_lines(clusters.positions, clusters.line_endpoints, clusters.line_types, layer_width, layer_height)
 
-            if current_node.node_id not in point_set:
-                continue
-            
-            # Aquire the other node ID from the set.
-            point_set.remove(current_node.node_id)
-            
-            try:
-                new_node_id = point_set.pop()
-            except KeyError:
-                print(l, find_waypoint_by_id(l["p1"]), find_waypoint_by_id(l["p2"]))
-                return None
+    # RENDER CLUSTERS
+    waypoint_camera_scale_pixels = get_waypoint_scale_pixels(camera_zoom)
+    taken_label_cells = set()
+    lonely_waypoints = [] # (waypoint, camera position) of clusters of one
 
-            new_node = Node(new_node_id) # Create the node!
+    visible_clusters = geometry.points_in_rect(clusters.positions, *get_camera_world_rect(STATIC_LAYER_MARGIN + LOD_CLUSTER_PIXELS)).nonzero()[0]
 
-            children.append(new_node) # Append the child to the... children.
+    for ic, count, iw in zip(visible_clusters.tolist(), clusters.counts[visible_clusters].tolist(), clusters.representatives[visible_clusters].tolist()):
+        cluster_camera_pos = cluster_camera_positions[ic]
 
-        # Get the current waypoint (we'll need it later!)
-        current_waypoint = find_waypoint_by_id(current_node.node_id)
+        # A lonely waypoint gets drawn like it would be zoomed in
+        if count == 1:
+            w = network_arrays.waypoints[iw]
 
-        # Process the children
-        for child in children:
-            if child in closed_list: # Have we processed this node already?
-                continue # We have. NEXT!
+            draw_waypoint(w, cluster_camera_pos, waypoint_camera_scale_pixels)
+            lonely_waypoints.append((w, cluster_camera_pos))
 
-            # Get the distance between this node and the child
-            child_waypoint = find_waypoint_by_id(child.node_id)
-            
-            # Store the distance between the current node and the child node in G
-            child.g = current_node.g + math.dist(current_waypoint["pos"], child_waypoint["pos"])
-            
-            # Multiply the distance by 
-
-            # Store the estimated distance from the child node and the end node in H
-            child.h = math.dist(child_waypoint["pos"], end_waypoint["pos"])
-            # Store the total cost of the child node in F
-            child.f = child.g + child.h
-            # And of course, set the parent as the current node
-            child.parent = current_node
-
-            do_continue = False
-            for open_node in open_list:
-                if child == open_node and child.g > open_node.g:
-                    do_continue = True
-            
-            if do_continue:
-                continue
+            continue
 
-            open_list.append(child)
+        pygame.draw.circle(
+            static_layer,
+            LOD_CLUSTER_COLOR,
+            cluster_camera_pos,
+            clamp(LOD_CLUSTER_PIXELS / 4 + math.sqrt(count), WAYPOINT_SIZE_MIN / 2, LOD_CLUSTER_PIXELS / 2)
+        )
 
-# WEBSOCKET
+        # The count always gets drawn, and other labels have to stay out of its way
+        text_surface = get_label(f" {count} ", (0, 0, 0), LOD_CLUSTER_COLOR)
+        text_rect = text_surface.get_rect(center=cluster_camera_pos)
 
-def websocket_loop_thread(quit_event):
-    #websocket.enableTrace(True)
-    ws = websocket.WebSocket()
-    ws.connect(WS_URL)
+        claim_label_space(text_rect, taken_label_cells)
+        static_layer.blit(text_surface, text_rect)
 
-    while not quit_event.is_set():
-        message = ws.recv()
+    frame_profiler.count("waypoints drawn", len(visible_clusters)) # Markers, not waypoints
+    frame_profiler.count("waypoints culled", len(network_arrays.index) - int(clusters.counts[visible_clusters].sum()))
+    frame_profiler.mark("waypoints")
 
-        message = json.loads(message)
+    # RENDER LABELS (only the ones that fit in between the others)
+    if show_labels:
+        for w, cluster_camera_pos in lonely_waypoints:
+            text_surface = get_waypoint_label(w)
+            text_rect = text_surface.get_rect(topleft=(cluster_camera_pos[0] + 6, cluster_camera_pos[1] + 6))
 
-        global players
-        if message["type"] == "playerMove":
-            players[message["id"]] = {"pos": (message["x"], message["z"])}
-        if message["type"] == "playerGone":
-            del players[message["id"]]
+            if claim_label_space(text_rect, taken_label_cells):
+                static_layer.blit(text_surface, text_rect)
 
-    ws.close()
+    frame_profiler.mark("labels")
 
-# LOAD WAYPOINTS
+def get_static_layer_offset():
+    """Returns where to blit the static layer so it lines up with the camera, or None if it doesn't cover the screen anymore"""
+    drawn_camera_x, drawn_camera_y, drawn_camera_zoom = static_layer_camera
 
-load_waypoints()
+    offset_x = round((drawn_camera_x - camera_x) * camera_zoom)
+    offset_y = round((drawn_camera_y - camera_y) * camera_zoom)
 
-#print(waypoints)
+    if abs(offset_x) > STATIC_LAYER_MARGIN or abs(offset_y) > STATIC_LAYER_MARGIN:
+        return None
 
-# PYGAME STUFF
+    return (offset_x - STATIC_LAYER_MARGIN, offset_y - STATIC_LAYER_MARGIN)
 
-screen = pygame.display.set_mode(SIZE)
-pygame.display.set_caption("Google Maps")
+# SETUP
 
-clock = pygame.time.Clock()
+def init_window():
+    global screen, clock, logo_aircs, logo_sqtr, logo_clyrail
 
-# LOGOS
+    # PYGAME STUFF
 
-logo_aircs   = pygame.image.load("logos/aircs.png")
-logo_sqtr    = pygame.image.load("logos/sqtr.png")
-logo_clyrail = pygame.image.load("logos/clyrail.png")
+    screen = pygame.display.set_mode(SIZE)
+    pygame.display.set_caption("Google Maps")
 
-# THREADING
+    # Typing only goes to the search box while it's open
+    pygame.key.stop_text_input()
 
-quit_event = threading.Event()
+    clock = pygame.time.Clock()
 
-t = threading.Thread(target=websocket_loop_thread, daemon=True, args=(quit_event,))
-t.start()
+    # LOGOS
 
-# MAIN LOOP
+    logo_aircs   = pygame.image.load("logos/aircs.png")
+    logo_sqtr    = pygame.image.load("logos/sqtr.png")
+    logo_clyrail = pygame.image.load("logos/clyrail.png")
 
-running = True
-while running:
-    clock.tick(FPS)
+    if PREWARM_LOGO_CACHE:
+        for step in range(ZOOM_STEPS):
+            for logo in (logo_aircs, logo_sqtr, logo_clyrail):
+                get_scaled_logo(logo, int(get_waypoint_scale_pixels(zoom_from_step(step))))
 
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-    
-        # MOVING
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            #print(event.button)
-            if event.button == 1: # Left button
-                w = get_waypoint_under_point(*event.pos)
-
-                if w is not None:
-                    if w["id"] == selected_waypoint:
-                        selected_waypoint = None
-                    else:
-                        selected_waypoint = w["id"]
+def create_feed_source():
+    feed_replay_speed = math.inf if FEED_REPLAY_SPEED == "max" else float(FEED_REPLAY_SPEED)
 
-            if event.button == 2: # Middle button
-                moving_camera = True
-            
-            if event.button == 3: # Right button
-                if selected_waypoint is not None:
-                    w = get_waypoint_under_point(*event.pos)
-                    
-                    if w is not None:
-                        if w["id"] != selected_waypoint:
-                            # Verify that the line we're about to delete exists
-                            valid = True
-                            
-                            delete_index = None
-                            for il, l in enumerate(data["lines"]):
-                                # These are not dictionaries, these are sets.
-                                if {l["p1"], l["p2"]} == {w["id"], selected_waypoint}:
-                                    delete_index = il
-                                    break
-                            
-                            if delete_index is not None:
-                                del data["lines"][delete_index]
+    if FEED_REPLAY:
+        return feed.FeedReplay(feed.read_recording(FEED_REPLAY), player_feed, feed_replay_speed)
 
-            if event.button == 7 or event.button == 6: # Side/front button or Side/back button
-                if selected_waypoint is not None:
-                    w = get_waypoint_under_point(*event.pos)
+    if FEED_SYNTHETIC_PLAYERS:
+        return feed.FeedReplay(feed.synthesize_recording(FEED_SYNTHETIC_PLAYERS, FEED_SYNTHETIC_SECONDS), player_feed, feed_replay_speed)
 
-                    if w is not None:
-                        if w["id"] != selected_waypoint:
-                            # Verify that the line we're about to create is new
-                            valid = True
-
-                            for l in data["lines"]:
-                                # These are not dictionaries, these are sets.
-                                if {l["p1"], l["p2"]} == {w["id"], selected_waypoint}:
-                                    valid = False
-
-                            if valid:
-                                data["lines"].append({"p1": selected_waypoint, "p2": w["id"], "type": 0 if event.button == 7 else 1})
-                                selected_waypoint = None
-        
+    return feed.FeedClient(WS_URL, player_feed, feed.FeedRecorder(FEED_RECORD) if FEED_RECORD else None)
 
-        elif event.type == pygame.MOUSEBUTTONUP:
-            if event.button == 2: # Middle button
-                moving_camera = False
+# FRAME
 
-        elif event.type == pygame.MOUSEMOTION:
-            if moving_camera:
-                camera_x -= event.rel[0] / camera_zoom
-                camera_y -= event.rel[1] / camera_zoom
+def update_players():
+    """Swaps in the player updates that came in since the last frame"""
+    global players
 
-        # ZOOMING
-        elif event.type == pygame.MOUSEWHEEL:
-            camera_zoom_step += event.y
+    frame_profiler.count("feed queue", player_feed.pending_count())
+    frame_profiler.count("feed superseded", player_feed.superseded)
 
-            log_min_zoom = math.log(MIN_ZOOM)
-            log_max_zoom = math.log(MAX_ZOOM)
-            log_zoom = log_min_zoom + (log_max_zoom - log_min_zoom) * camera_zoom_step / (ZOOM_STEPS - 1)
-            camera_zoom = math.exp(log_zoom)
+    now = time.monotonic()
 
-        # KEYS
-        elif event.type == pygame.KEYDOWN:
-            # TOGGLE LABELS
-            if event.key == pygame.K_l:
-                show_labels = not show_labels
+    for name, pos in player_feed.swap().items():
+        if pos is None:
+            player_grid.remove(name)
+            player_tracks.remove(name)
+        else:
+            player_grid.move_point(name, *pos)
+            player_tracks.update(name, pos, now)
 
-            # TOGGLE PLAYERS
-            if event.key == pygame.K_p:
-                show_players = not show_players
+    players = player_feed.players
 
-            # TOGGLE DEBUG IDS
-            if event.key == pygame.K_d:
-                show_debug_ids = not show_debug_ids
+def cancel_route_preview_search():
+    """Stops the route preview search and drops its result. Has to happen before the graph it's reading is edited"""
+    global route_preview_future
 
-            # RELOAD WAYPOINTS
-            if event.key == pygame.K_r:
-                load_waypoints()
-                last_path = [] # Reset path because the IDs are refreshed every time
+    if route_preview_future is not None:
+        route_preview_cancel.set()
+        route_preview_future = None
 
-            # SAVE DATA
-            if event.key == pygame.K_s:
-                save_waypoints()
+def update_route_preview():
+    """Finds alternative routes to the waypoint under the mouse, whenever it changes. They show up once route_preview_pool found them"""
+    global route_preview, route_preview_key, route_preview_future, route_preview_future_key, route_preview_cancel
 
-            # FIND PATH
-            if event.key == pygame.K_f:
-                if selected_waypoint is not None:
-                    w = get_waypoint_under_point(*pygame.mouse.get_pos())
+    w = get_waypoint_under_point(*pygame.mouse.get_pos()) if selected_waypoint is not None else None
 
-                    if w is not None:
-                        last_path = find_path_a_star(selected_waypoint, w["id"])
+    if w is None or w["id"] == selected_waypoint:
+        route_preview = []
+        route_preview_key = None
+        return
 
-                        if last_path is None:
-                            last_path = []
+    # Graphs are replaced when switching between distance and travel time, edits reset route_preview_key
+    graph = get_route_graph()
+    key = (selected_waypoint, w["id"], graph)
 
-    # UPDATE STUFF HERE
+    if key == route_preview_key:
+        return
 
-    # DRAW STUFF HERE
-    
-    screen.fill((36, 34, 31))
-    
-    # RENDER LINES
-    for l in data["lines"]:
-        first_waypoint = find_waypoint_by_id(l["p1"])
-        second_waypoint = find_waypoint_by_id(l["p2"])
+    # The old routes go somewhere else
+    route_preview = []
+
+    cached = routing.cached_alternative_routes(graph, selected_waypoint, w["id"])
+
+    if cached is not None:
+        route_preview = cached
+        route_preview_key = key
+        return
+
+    # Only one search at a time, whatever is hovered when it's done gets searched for next
+    if route_preview_future is not None:
+        if not route_preview_future.done():
+            # Something else is hovered now, no need to finish
+            if route_preview_future_key != key:
+                route_preview_cancel.set()
+
+            return
+
+        # A cancelled search only has some of the routes
+        if route_preview_future_key == key and not route_preview_cancel.is_set():
+            route_preview = route_preview_future.result()
+            route_preview_key = key
+            routing.cache_alternative_routes(graph, selected_waypoint, w["id"], route_preview)
+
+        route_preview_future = None
+
+        if route_preview_key == key:
+            return
+
+    route_preview_cancel = threading.Event()
+    route_preview_future = route_preview_pool.submit(routing.search_alternative_routes, graph, selected_waypoint, w["id"], cancel=route_preview_cancel)
+    route_preview_future_key = key
+
+def draw_frame():
+    """Draws everything onto the screen, without flipping it"""
+
+    # RENDER STATIC LAYER (lines, waypoints and labels)
+    if static_layer_dirty or static_layer_camera[2] != camera_zoom:
+        draw_static_layer()
+
+    static_layer_offset = get_static_layer_offset()
+
+    if static_layer_offset is None: # Panned too far away from where the static layer was drawn
+        draw_static_layer()
+        static_layer_offset = get_static_layer_offset()
+
+    screen.blit(static_layer, static_layer_offset)
 
-        first_waypoint_camera_pos = apply_camera(first_waypoint["pos"][0], first_waypoint["pos"][1])
-        second_waypoint_camera_pos = apply_camera(second_waypoint["pos"][0], second_waypoint["pos"][1])
+    frame_profiler.mark("static layer")
 
-        if point_rect_collision(*first_waypoint_camera_pos, 0, 0, WIDTH, HEIGHT) \
-            or point_rect_collision(*second_waypoint_camera_pos, 0, 0, WIDTH, HEIGHT) \
-            or line_rect_collision(*first_waypoint_camera_pos, *second_waypoint_camera_pos, 0, 0, WIDTH, HEIGHT):
-            pygame.draw.line(screen, (255, 255, 255) if l["type"] == 0 else (128, 128, 128), first_waypoint_camera_pos, second_waypoint_camera_pos, width=int(clamp(apply_camera_zoom(5), 2, float("inf"))))
+    # RENDER ROUTE PREVIEW, worst first so the best ends up on top
+    for (_, path), color in reversed(list(zip(route_preview, ROUTE_PREVIEW_COLORS))):
+        path_positions = [apply_camera(*find_waypoint_by_id(i)["pos"]) for i in path]
+
+        if len(path_positions) >= 2:
+            pygame.draw.lines(screen, color, False, path_positions, width=int(clamp(apply_camera_zoom(2), 2, float("inf"))))
 
     # RENDER PATH
     path_positions = [apply_camera(*find_waypoint_by_id(i)["pos"]) for i in last_path]
@@ -438,74 +938,57 @@ while running:
     if len(path_positions) >= 2:
         pygame.draw.lines(screen, (0, 255, 0), False, path_positions, width=int(clamp(apply_camera_zoom(3), 3, float("inf"))))
 
-    # RENDER WAYPOINTS
+    # RENDER SELECTION
+    w = network_index.waypoints.get(selected_waypoint)
 
-    for w in data["waypoints"]:
+    if w is not None:
         waypoint_camera_pos = apply_camera(w["pos"][0], w["pos"][1])
-        waypoint_camera_scale_pixels = clamp(apply_camera_zoom(WAYPOINT_SIZE), WAYPOINT_SIZE_MIN, float("inf"))
+        waypoint_camera_scale_pixels = get_waypoint_scale_pixels(camera_zoom)
 
-        if point_rect_collision(*waypoint_camera_pos, -waypoint_camera_scale_pixels, -waypoint_camera_scale_pixels, WIDTH + waypoint_camera_scale_pixels * 2, HEIGHT + waypoint_camera_scale_pixels * 2):
-            #color = (212, 64, 44)  if w["type"] == "AirCS"   else (
-            #        (55, 66, 219)  if w["type"] == "SQTR"    else (
-            #        (73, 216, 235) if w["type"] == "SkyRail" else (
-            #        (237, 227, 26) if w["type"] == "ClyRail" else (255, 255, 255))))
-            
-            if selected_waypoint == w["id"]:
-                pygame.draw.rect(
-                    screen,
-                    (255, 255, 255),
-                    (waypoint_camera_pos[0] - waypoint_camera_scale_pixels / 2 - SELECTION_WIDTH,
-                     waypoint_camera_pos[1] - waypoint_camera_scale_pixels / 2 - SELECTION_WIDTH,
-                     waypoint_camera_scale_pixels + SELECTION_WIDTH * 2,
-                     waypoint_camera_scale_pixels + SELECTION_WIDTH * 2),
-                )
-            
-            logo_to_use = logo_aircs   if w["type"] == "AirCS"   else (
-                          logo_sqtr    if w["type"] == "SQTR"    else (
-                          logo_clyrail if w["type"] == "ClyRail" else None))
-
-            if logo_to_use is not None:
-                screen.blit(
-                    pygame.transform.scale(logo_to_use, (waypoint_camera_scale_pixels,) * 2),
-                    (
-                        waypoint_camera_pos[0] - waypoint_camera_scale_pixels / 2,
-                        waypoint_camera_pos[1] - waypoint_camera_scale_pixels / 2
-                    )
-                )
-            else:
-                pygame.draw.circle(
-                    screen,
-                    (73, 216, 235),#color,
-                    waypoint_camera_pos,
-                    waypoint_camera_scale_pixels // 2,
-                    int(clamp(apply_camera_zoom(5), 2, float("inf")))
-                )
-
-            if show_labels:
-                text_surface = FONT.render(f" {w['name']} {tuple(w['pos'])}{' ' + str(w['id']) if show_debug_ids else ''} ", True, (255, 255, 255), (0, 0, 0)).convert_alpha()
-                text_surface.set_alpha(192)
-                screen.blit(text_surface, (waypoint_camera_pos[0] + 6, waypoint_camera_pos[1] + 6))
-        
-        # RENDER PLAYERS
-        if show_players:
-            try:
-                for name, p in players.items():
-                    player_camera_pos = apply_camera(p["pos"][0], p["pos"][1])
-                    player_camera_radius = clamp(apply_camera_zoom(1), 5, float("inf")) 
-
-                    if point_rect_collision(*player_camera_pos, -player_camera_radius, -player_camera_radius, WIDTH + player_camera_radius * 2, HEIGHT + player_camera_radius * 2):
-                        pygame.draw.circle(
-                            screen,
-                            (60, 237, 47),
-                            player_camera_pos,
-                            player_camera_radius
-                        )
-
-                        text_surface = FONT.render(f" {name} {tuple(map(round, p['pos']))} ", True, (255, 255, 255), (36, 41, 38)).convert_alpha()
-                        text_surface.set_alpha(192)
-                        screen.blit(text_surface, apply_camera(p["pos"][0], p["pos"][1]))
-            except RuntimeError: # Sometimes players get deleted in the middle of rendering.
-                pass
+        # The waypoint is already drawn, so only draw a frame around it
+        pygame.draw.rect(
+            screen,
+            (255, 255, 255),
+            (waypoint_camera_pos[0] - waypoint_camera_scale_pixels / 2 - SELECTION_WIDTH,
+             waypoint_camera_pos[1] - waypoint_camera_scale_pixels / 2 - SELECTION_WIDTH,
+             waypoint_camera_scale_pixels + SELECTION_WIDTH * 2,
+             waypoint_camera_scale_pixels + SELECTION_WIDTH * 2),
+            SELECTION_WIDTH
+        )
+
+    frame_profiler.mark("path")
+
+    # RENDER PLAYERS
+    if show_players:
+        player_camera_radius = clamp(apply_camera_zoom(1), 5, float("inf"))
+
+        # Gliding players are at most PLAYER_TELEPORT_DISTANCE away from where the grid has them
+        nearby_players = list(player_grid.query(*get_camera_world_rect(player_camera_radius + apply_camera_zoom(PLAYER_TELEPORT_DISTANCE))))
+        player_world_positions = player_tracks.positions([player_tracks.index[name] for name in nearby_players], time.monotonic())
+
+        visible = geometry.points_in_rect(player_world_positions, *get_camera_world_rect(player_camera_radius)).nonzero()[0]
+        player_camera_positions = geometry.apply_camera(player_world_positions[visible], camera_x, camera_y, camera_zoom, WIDTH, HEIGHT).tolist()
+
+        for ip, player_camera_pos in zip(visible.tolist(), player_camera_positions):
+            name = nearby_players[ip]
+
+            pygame.draw.circle(
+                screen,
+                (60, 237, 47),
+                player_camera_pos,
+                player_camera_radius
+            )
+
+            # Where the feed put the player rather than where it's drawn, rounded, so the label only changes with the text
+            text_surface = get_label(f" {name} {tuple(map(round, players[name]))} ", (255, 255, 255), (36, 41, 38))
+            screen.blit(text_surface, player_camera_pos)
+
+        players_drawn = len(player_camera_positions)
+
+        frame_profiler.count("players drawn", players_drawn)
+        frame_profiler.count("players culled", len(players) - players_drawn)
+
+    frame_profiler.mark("players")
 
     # RENDER ORIGIN
     pygame.draw.circle(
@@ -515,22 +998,285 @@ while running:
         clamp(apply_camera_zoom(1), 5, float("inf"))
     )
 
-    text_surface = FONT.render(f" (0, 0) ", True, (255, 255, 255), (0, 0, 0)).convert_alpha()
-    text_surface.set_alpha(192)
+    text_surface = get_label(" (0, 0) ", (255, 255, 255), (0, 0, 0))
     screen.blit(text_surface, apply_camera(0, 0))
 
     # RENDER SELECTED TEXT
-    try:
-        w = find_waypoint_by_id(selected_waypoint)
+    w = network_index.waypoints.get(selected_waypoint)
 
+    if w is not None:
         text_surface = FONT.render(f" Selected: {w['type']} - {w['name']} {tuple(w['pos'])} ", True, (255, 255, 255), (0, 0, 0))
         screen.blit(text_surface, (0, 0))
-    except IndexError:
-        pass
 
-    pygame.display.flip()
+        text_y = text_surface.get_height()
+
+        for n, ((cost, path), color) in enumerate(zip(route_preview, ROUTE_PREVIEW_COLORS)):
+            cost_text = f"{round(cost)}s" if fastest_routes else f"{round(cost)} blocks"
+            text_surface = FONT.render(f" Route {n + 1}: {cost_text}, {len(path) - 1} hops ", True, color, (0, 0, 0))
+            screen.blit(text_surface, (0, text_y))
+
+            text_y += text_surface.get_height()
+
+    # RENDER CONNECTION STATUS
+    status_text = feed_source.describe_status() if feed_source is not None else None
+
+    if status_text is not None:
+        text_surface = FONT.render(f" {status_text} ", True, (255, 128, 128), (0, 0, 0))
+        screen.blit(text_surface, (0, HEIGHT - text_surface.get_height()))
+
+    # RENDER SAVE STATUS
+    if saver is not None:
+        if saver.error is not None:
+            save_text, save_color = f"Couldn't save: {saver.error}", (255, 128, 128)
+        elif saver.busy:
+            save_text, save_color = "Saving...", (255, 255, 255)
+        else:
+            save_text = None
+
+        if save_text is not None:
+            text_surface = FONT.render(f" {save_text} ", True, save_color, (0, 0, 0))
+            screen.blit(text_surface, (WIDTH - text_surface.get_width(), HEIGHT - text_surface.get_height()))
+
+    # RENDER SEARCH
+    if name_search is not None:
+        search_lines = [(f" Search: {search_query}_ ", SEARCH_COLOR)]
+
+        for n, w_id in enumerate(search_results):
+            w = find_waypoint_by_id(w_id)
+            search_lines.append((f" {w['type']} - {w['name']} {tuple(w['pos'])} ", SEARCH_CHOICE_COLOR if n == search_choice else SEARCH_COLOR))
+
+        if name_index is None:
+            search_lines.append((" Indexing names... ", SEARCH_COLOR))
+        elif search_query and not search_results:
+            search_lines.append((" No matches ", SEARCH_COLOR))
+
+        text_y = 0
+
+        for text, color in search_lines:
+            text_surface = FONT.render(text, True, color, (0, 0, 0))
+            screen.blit(text_surface, ((WIDTH - text_surface.get_width()) // 2, text_y))
+
+            text_y += text_surface.get_height()
+
+    # RENDER PROFILER HUD
+    if frame_profiler.enabled:
+        frame_profiler.count("logo cache hit %", profiling.cache_hit_percent(get_scaled_logo.cache_info()))
+        frame_profiler.count("label cache hit %", profiling.cache_hit_percent(get_label.cache_info()))
+
+    if frame_profiler.show_hud:
+        hud_y = 0
+
+        for line in frame_profiler.hud_lines():
+            text_surface = HUD_FONT.render(f" {line} ", True, (255, 255, 255), (0, 0, 0))
+            screen.blit(text_surface, (WIDTH - text_surface.get_width(), hud_y))
+            hud_y += text_surface.get_height()
+
+    frame_profiler.mark("overlay")
+
+if __name__ == "__main__":
+    # LOAD WAYPOINTS
+
+    saver = saving.BackgroundSaver(PATH)
+
+    load_waypoints()
+
+    init_window()
+
+    # PLAYER FEED
+
+    feed_source = create_feed_source()
+
+    # THREADING
+
+    quit_event = threading.Event()
+
+    t = threading.Thread(target=feed_source.run, daemon=True, args=(quit_event,))
+    t.start()
+
+    # MAIN LOOP
+
+    running = True
+    while running:
+        clock.tick(FPS)
+
+        frame_profiler.start_frame()
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+    
+            # MOVING
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                #print(event.button)
+                if event.button == 1: # Left button
+                    w = get_waypoint_under_point(*event.pos)
+
+                    if w is not None:
+                        if w["id"] == selected_waypoint:
+                            selected_waypoint = None
+                        else:
+                            selected_waypoint = w["id"]
+
+                if event.button == 2: # Middle button
+                    moving_camera = True
+            
+                if event.button == 3: # Right button
+                    if selected_waypoint is not None:
+                        w = get_waypoint_under_point(*event.pos)
+                    
+                        if w is not None:
+                            if w["id"] != selected_waypoint:
+                                # Verify that the line we're about to delete exists
+                                l = find_line_by_ids(w["id"], selected_waypoint)
+                            
+                                if l is not None:
+                                    remove_line(l)
+
+                if event.button == 7 or event.button == 6: # Side/front button or Side/back button
+                    if selected_waypoint is not None:
+                        w = get_waypoint_under_point(*event.pos)
+
+                        if w is not None:
+                            if w["id"] != selected_waypoint:
+                                # Verify that the line we're about to create is new
+                                if find_line_by_ids(w["id"], selected_waypoint) is None:
+                                    l = {"p1": selected_waypoint, "p2": w["id"], "type": 0 if event.button == 7 else 1}
+
+                                    add_line(l)
+                                    selected_waypoint = None
+        
+
+            elif event.type == pygame.MOUSEBUTTONUP:
+                if event.button == 2: # Middle button
+                    moving_camera = False
+
+            elif event.type == pygame.MOUSEMOTION:
+                if moving_camera:
+                    camera_x -= event.rel[0] / camera_zoom
+                    camera_y -= event.rel[1] / camera_zoom
+
+            # ZOOMING
+            elif event.type == pygame.MOUSEWHEEL:
+                camera_zoom_step += event.y
+                camera_zoom = zoom_from_step(camera_zoom_step)
+
+            # SEARCH
+            elif event.type == pygame.KEYDOWN and name_search is not None:
+                handle_search_key(event)
+
+            elif event.type == pygame.TEXTINPUT and name_search is not None:
+                update_search(search_query + event.text)
+
+            # KEYS
+            elif event.type == pygame.KEYDOWN:
+                # SEARCH BY NAME
+                if event.key == pygame.K_SLASH:
+                    open_search()
+
+                # TOGGLE LABELS
+                if event.key == pygame.K_l:
+                    show_labels = not show_labels
+                    static_layer_dirty = True
+
+                # TOGGLE PLAYERS
+                if event.key == pygame.K_p:
+                    show_players = not show_players
+
+                # TOGGLE PROFILER HUD
+                if event.key == pygame.K_F3:
+                    frame_profiler.show_hud = not frame_profiler.show_hud
+
+                # TOGGLE DEBUG IDS
+                if event.key == pygame.K_d:
+                    show_debug_ids = not show_debug_ids
+                    static_layer_dirty = True
+
+                # TOGGLE ROUTING BY TRAVEL TIME
+                if event.key == pygame.K_t:
+                    fastest_routes = not fastest_routes
+
+                # RELOAD WAYPOINTS
+                if event.key == pygame.K_r:
+                    # Keep the edits made so far, they're replayed from the journal
+                    autosave(force=True)
+                    saver.wait()
+
+                    load_waypoints()
+
+                    # Find the path again if both its ends are still there, as anything in between could have changed
+                    if last_path and last_path[0] in network_index.waypoints and last_path[-1] in network_index.waypoints:
+                        last_path = find_path_a_star(last_path[0], last_path[-1]) or []
+                    else:
+                        last_path = []
+
+                # DELETE SELECTED WAYPOINT
+                if event.key == pygame.K_DELETE:
+                    if selected_waypoint is not None:
+                        remove_waypoint(selected_waypoint)
+
+                # SAVE DATA
+                if event.key == pygame.K_s:
+                    save_waypoints()
+
+                # FIND PATH
+                if event.key == pygame.K_f:
+                    if selected_waypoint is not None:
+                        w = get_waypoint_under_point(*pygame.mouse.get_pos())
+
+                        if w is not None:
+                            last_path = find_path_a_star(selected_waypoint, w["id"])
+
+                            if last_path is None:
+                                last_path = []
+
+                # FIND PATH TO THE NEAREST WAYPOINT OF THE SAME TYPE AS THE ONE UNDER THE MOUSE
+                if event.key == pygame.K_n:
+                    if selected_waypoint is not None:
+                        w = get_waypoint_under_point(*pygame.mouse.get_pos())
+
+                        if w is not None:
+                            nearest_id = find_nearest_of_type(selected_waypoint, w["type"])
+                            last_path = find_path_a_star(selected_waypoint, nearest_id) if nearest_id is not None else None
+
+                            if last_path is None:
+                                last_path = []
+
+        frame_profiler.mark("events")
+
+        # UPDATE STUFF HERE
+
+        update_players()
+
+        frame_profiler.mark("update players")
+
+        update_route_preview()
+
+        frame_profiler.mark("route preview")
+
+        collect_lod_clusters()
+        collect_name_index()
+
+        autosave()
+
+        # DRAW STUFF HERE
+
+        draw_frame()
+
+        pygame.display.flip()
+
+        frame_profiler.mark("flip")
+        frame_profiler.end_frame()
+
+    quit_event.set()
+
+    # Whatever isn't journaled yet would be lost
+    autosave(force=True)
+    saver.close()
 
-quit_event.set()
+    route_preview_pool.shutdown(wait=False, cancel_futures=True)
+    lod_clusters_pool.shutdown(wait=False, cancel_futures=True)
+    name_index_pool.shutdown(wait=False, cancel_futures=True)
 
-pygame.quit()
+    frame_profiler.close()
 
+    pygame.quit()
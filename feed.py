@@ -0,0 +1,254 @@
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import types
+
+from websockets.asyncio.client import connect
+from websockets.exceptions import WebSocketException
+
+# CLIENT CONSTANTS
+
+RECONNECT_DELAY_MIN = 1 # Seconds
+RECONNECT_DELAY_MAX = 60
+
+HEARTBEAT_INTERVAL = 10 # Seconds between pings
+HEARTBEAT_TIMEOUT = 10 # Seconds to wait for a pong before giving up on the connection
+SILENCE_TIMEOUT = 60 # Seconds without any message before reconnecting anyway
+
+INBOUND_BUFFER_SIZE = 256 # Messages the connection buffers before it stops reading from the socket
+QUIT_POLL_INTERVAL = 0.25 # Seconds between checks of the quit event
+
+# RECORDING CONSTANTS
+
+RECORDED_TYPES = ("playerMove", "playerGone")
+
+SYNTHETIC_SPREAD = 20000 # Fake players start within this many blocks of the origin
+SYNTHETIC_STEP = 8 # Blocks a fake player can move per update
+
+class PlayerFeed:
+    """Hands player updates over from the websocket thread to the render loop, once per frame"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # Updates since the last swap, only the latest one per player. None means the player is gone.
+        self.pending = {}
+        self.superseded = 0 # Updates that were replaced by a newer one before the render loop saw them
+
+        # What the render loop sees, player name -> (x, z). Never changed in place, only replaced.
+        self.players = types.MappingProxyType({})
+
+    def push(self, message):
+        if message["type"] == "playerMove":
+            update = (message["x"], message["z"])
+        elif message["type"] == "playerGone":
+            update = None
+        else:
+            return
+
+        with self.lock:
+            if message["id"] in self.pending:
+                self.superseded += 1
+
+            self.pending[message["id"]] = update
+
+    def pending_count(self):
+        return len(self.pending)
+
+    def swap(self):
+        """Publishes everything that came in since the last call. Returns the updates that were applied"""
+        with self.lock:
+            updates, self.pending = self.pending, {}
+
+        if updates:
+            players = dict(self.players)
+
+            for name, pos in updates.items():
+                if pos is None:
+                    players.pop(name, None)
+                else:
+                    players[name] = pos
+
+            self.players = types.MappingProxyType(players)
+
+        return updates
+
+class FeedClient:
+    """Keeps a websocket connection to the live map open, reconnecting when it drops, and pushes its messages into a PlayerFeed"""
+
+    def __init__(self, url, player_feed, recorder=None):
+        self.url = url
+        self.player_feed = player_feed
+        self.recorder = recorder
+
+        # Connection health, read by the UI
+        self.status = "connecting" # "connecting", "connected" or "disconnected"
+        self.error = None
+        self.reconnect_at = None # time.monotonic() of the next attempt while disconnected
+        self.attempts = 0 # Failed attempts since the last successful connection
+
+    def run(self, quit_event):
+        """Thread target. Returns once quit_event is set"""
+        try:
+            asyncio.run(self._run(quit_event))
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
+
+    def describe_status(self):
+        """Connection health for the UI, or None if everything is fine"""
+        if self.status == "connected":
+            return None
+
+        if self.status == "connecting":
+            return "Live feed: connecting..."
+
+        return f"Live feed: {self.error}, retrying in {max(0, math.ceil(self.reconnect_at - time.monotonic()))}s"
+
+    async def _run(self, quit_event):
+        while not quit_event.is_set():
+            self.status = "connecting"
+
+            try:
+                async with connect(
+                    self.url,
+                    ping_interval=HEARTBEAT_INTERVAL,
+                    ping_timeout=HEARTBEAT_TIMEOUT,
+                    max_queue=INBOUND_BUFFER_SIZE
+                ) as ws:
+                    self.status = "connected"
+                    self.error = None
+                    self.attempts = 0
+
+                    await self._receive(ws, quit_event)
+            except (OSError, TimeoutError, WebSocketException) as e:
+                self.error = str(e) or type(e).__name__
+
+            if quit_event.is_set():
+                break
+
+            # Back off exponentially, with some jitter so clients don't all come back at once
+            delay = min(RECONNECT_DELAY_MIN * 2 ** min(self.attempts, 16), RECONNECT_DELAY_MAX) * random.uniform(0.5, 1)
+
+            self.attempts += 1
+            self.reconnect_at = time.monotonic() + delay
+
+            # Last, describe_status() reads the rest from the render thread as soon as it sees this
+            self.status = "disconnected"
+
+            while not quit_event.is_set() and time.monotonic() < self.reconnect_at:
+                await asyncio.sleep(QUIT_POLL_INTERVAL)
+
+    async def _receive(self, ws, quit_event):
+        last_message_time = time.monotonic()
+
+        while not quit_event.is_set():
+            try:
+                message = await asyncio.wait_for(ws.recv(), QUIT_POLL_INTERVAL)
+            except TimeoutError:
+                # Pings keep dead connections in check, but a live connection that went quiet is suspicious too
+                if time.monotonic() - last_message_time > SILENCE_TIMEOUT:
+                    self.error = "No messages for %d seconds" % SILENCE_TIMEOUT
+                    return
+
+                continue
+
+            last_message_time = time.monotonic()
+
+            try:
+                parsed = json.loads(message)
+                self.player_feed.push(parsed)
+            except (ValueError, KeyError, TypeError): # Not a message we understand, don't let it kill the connection
+                continue
+
+            if self.recorder is not None and parsed["type"] in RECORDED_TYPES:
+                self.recorder.write(message)
+
+# RECORDING AND REPLAY
+
+class FeedRecorder:
+    """Appends raw feed messages to a file, one "<seconds since start>\t<message>" line each"""
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+        self.start_time = time.monotonic()
+
+    def write(self, message):
+        self.file.write("%.3f\t%s\n" % (time.monotonic() - self.start_time, message))
+
+    def close(self):
+        self.file.close()
+
+def read_recording(path):
+    """Yields (seconds since start, raw message) from a file written by FeedRecorder"""
+    offset = 0
+    last_time = 0
+
+    with open(path, "r") as f:
+        for line in f:
+            timestamp, _, message = line.rstrip("\n").partition("\t")
+
+            if not message:
+                continue
+
+            # Every recording session appended to the file starts from 0 again, so put it after the previous one
+            if float(timestamp) + offset < last_time:
+                offset = last_time - float(timestamp)
+
+            last_time = float(timestamp) + offset
+
+            yield last_time, message
+
+def synthesize_recording(player_count, seconds, updates_per_second=4, seed=0):
+    """Yields (seconds since start, raw message) for player_count players wandering around randomly"""
+    rng = random.Random(seed)
+    positions = [[rng.uniform(-SYNTHETIC_SPREAD, SYNTHETIC_SPREAD), rng.uniform(-SYNTHETIC_SPREAD, SYNTHETIC_SPREAD)] for _ in range(player_count)]
+
+    for step in range(int(seconds * updates_per_second)):
+        for i, pos in enumerate(positions):
+            pos[0] += rng.uniform(-SYNTHETIC_STEP, SYNTHETIC_STEP)
+            pos[1] += rng.uniform(-SYNTHETIC_STEP, SYNTHETIC_STEP)
+
+            yield step / updates_per_second, json.dumps({"type": "playerMove", "id": "Player%d" % i, "x": pos[0], "y": 64, "z": pos[1]})
+
+class FeedReplay:
+    """Pushes recorded messages into a PlayerFeed as if they came from the live feed. Has the same interface as FeedClient"""
+
+    def __init__(self, messages, player_feed, speed=1):
+        self.messages = messages # Iterable of (seconds since start, raw message)
+        self.player_feed = player_feed
+        self.speed = speed # math.inf replays as fast as possible
+
+        self.status = "connected" # "connected" while replaying, "finished" afterwards
+        self.replayed = 0
+
+    def run(self, quit_event):
+        start_time = time.monotonic()
+
+        for timestamp, message in self.messages:
+            if quit_event.is_set():
+                return
+
+            # Wait until the message is due, without missing the quit event for too long
+            due_time = start_time + timestamp / self.speed
+
+            while not quit_event.is_set() and time.monotonic() < due_time:
+                time.sleep(max(0, min(QUIT_POLL_INTERVAL, due_time - time.monotonic())))
+
+            try:
+                self.player_feed.push(json.loads(message))
+            except (ValueError, KeyError, TypeError):
+                continue
+
+            self.replayed += 1
+
+        self.status = "finished"
+
+    def describe_status(self):
+        if self.status == "finished":
+            return f"Replay finished ({self.replayed} messages)"
+
+        return None
@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import math
+import time
+
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+import feed
+
+# Stand-in for the live map's websocket, for testing display.py without the real server.
+# Replays a recording made with FEED_RECORD (or fake players) to everyone who connects, over and over.
+
+parser = argparse.ArgumentParser(description="Serve a recorded player feed over a local websocket")
+source = parser.add_mutually_exclusive_group(required=True)
+source.add_argument("recording", nargs="?", help="file written by display.py with FEED_RECORD set")
+source.add_argument("--synthetic", type=int, metavar="PLAYERS", help="serve this many fake players instead of a recording")
+parser.add_argument("--host", default="localhost")
+parser.add_argument("--port", type=int, default=8765)
+parser.add_argument("--speed", default="1", help="replay speed multiplier, or \"max\"")
+parser.add_argument("--drop-after", type=float, default=None, help="close every connection after this many seconds, to test reconnecting")
+args = parser.parse_args()
+
+speed = math.inf if args.speed == "max" else float(args.speed)
+
+if args.recording is not None:
+    messages = list(feed.read_recording(args.recording))
+else:
+    messages = list(feed.synthesize_recording(args.synthetic, 60))
+
+async def handler(ws):
+    async def send_messages():
+        while True:
+            start_time = time.monotonic()
+
+            for timestamp, message in messages:
+                delay = start_time + timestamp / speed - time.monotonic()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                await ws.send(message)
+
+            # Don't spin if the recording is empty
+            await asyncio.sleep(0)
+
+    try:
+        await asyncio.wait_for(send_messages(), args.drop_after)
+    except (TimeoutError, ConnectionClosed):
+        pass
+
+async def main():
+    async with serve(handler, args.host, args.port) as server:
+        print("Serving %d messages on ws://%s:%d" % (len(messages), args.host, args.port))
+        await server.serve_forever()
+
+asyncio.run(main())
@@ -0,0 +1,422 @@
+import math
+import types
+
+import numpy as np
+
+class NetworkArrays:
+    """Waypoint positions and line endpoints as NumPy arrays, so the whole network can be processed at once.
+    The arrays have spare room at the end, so edits don't have to copy them."""
+
+    def __init__(self, data, columns=None):
+        self.waypoints = data["waypoints"].copy() # Removed waypoints leave None behind, and a NaN position
+
+        self.lines = []
+        self.line_rows = {} # id() of a line -> its row in the line arrays
+
+        # Straight from a network_file.NetworkFile of the same data, without looking at (or building) every waypoint and line
+        if columns is not None:
+            self.index = dict(zip(columns.ids.tolist(), range(len(columns.ids))))
+            self._positions = np.array(columns.positions)
+
+            present = np.flatnonzero((columns.line_ends >= 0).all(axis=1))
+            self.lines = data["lines"].select(present.tolist())
+            self.line_rows = None # Built the first time a line is removed, it needs every line
+
+            self._line_endpoints = columns.line_ends[present].astype(np.intp)
+            self._line_types = np.array(columns.line_types[present])
+
+            return
+
+        self.index = {w["id"]: i for i, w in enumerate(self.waypoints)}
+        self._positions = np.array([w["pos"] for w in self.waypoints], dtype=np.float64).reshape(-1, 2)
+
+        endpoints = []
+        types = []
+
+        for l in data["lines"]:
+            i = self.index.get(l["p1"])
+            j = self.index.get(l["p2"])
+
+            # Broken line, it can't be drawn anyway
+            if i is None or j is None:
+                continue
+
+            self.line_rows[id(l)] = len(self.lines)
+            self.lines.append(l)
+            endpoints.append((i, j))
+            types.append(l["type"])
+
+        self._line_endpoints = np.array(endpoints, dtype=np.intp).reshape(-1, 2)
+        self._line_types = np.array(types, dtype=np.int8)
+
+    @property
+    def positions(self):
+        return self._positions[:len(self.waypoints)]
+
+    @property
+    def line_endpoints(self):
+        return self._line_endpoints[:len(self.lines)]
+
+    @property
+    def line_types(self):
+        return self._line_types[:len(self.lines)]
+
+    def snapshot(self):
+        """Copies of the arrays, to make Clusters from on another thread while this is edited"""
+        return types.SimpleNamespace(positions=self.positions.copy(), line_endpoints=self.line_endpoints.copy(), line_types=self.line_types.copy())
+
+    def add_waypoint(self, waypoint):
+        self._positions = _with_room(self._positions, len(self.waypoints) + 1)
+        self._positions[len(self.waypoints)] = waypoint["pos"]
+
+        self.index[waypoint["id"]] = len(self.waypoints)
+        self.waypoints.append(waypoint)
+
+    def remove_waypoint(self, w_id):
+        """Removes a waypoint, which leaves a hole so no other waypoint has to move. Its lines have to be removed first"""
+        i = self.index.pop(w_id)
+
+        self.waypoints[i] = None
+        self._positions[i] = np.nan # Never inside any rectangle
+
+    def add_line(self, line):
+        """Returns the rows of the line's waypoints, or None if it's broken and was left out"""
+        i = self.index.get(line["p1"])
+        j = self.index.get(line["p2"])
+
+        if i is None or j is None:
+            return None
+
+        row = len(self.lines)
+
+        self._line_endpoints = _with_room(self._line_endpoints, row + 1)
+        self._line_types = _with_room(self._line_types, row + 1)
+
+        self._line_endpoints[row] = (i, j)
+        self._line_types[row] = line["type"]
+
+        if self.line_rows is not None:
+            self.line_rows[id(line)] = row
+
+        self.lines.append(line)
+
+        return i, j
+
+    def remove_line(self, line):
+        """Returns the rows of the line's waypoints, or None if it was never added"""
+        if self.line_rows is None:
+            self.line_rows = {id(l): row for row, l in enumerate(self.lines)}
+
+        row = self.line_rows.pop(id(line), None)
+
+        if row is None:
+            return None
+
+        ends = tuple(self._line_endpoints[row].tolist())
+
+        # Move the last line into the hole
+        last = len(self.lines) - 1
+
+        if row != last:
+            self.lines[row] = self.lines[last]
+            self._line_endpoints[row] = self._line_endpoints[last]
+            self._line_types[row] = self._line_types[last]
+            self.line_rows[id(self.lines[row])] = row
+
+        self.lines.pop()
+
+        return ends
+
+def _with_room(array, size):
+    """Returns array, or a copy with room for at least size rows, doubling so appending stays O(1) on average"""
+    if size <= len(array):
+        return array
+
+    grown = np.empty((max(size, len(array) * 2),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+
+    return grown
+
+class Clusters:
+    """The network with its waypoints merged into one marker per grid cell, for drawing it zoomed out.
+    Edits are applied in place, with the waypoint rows of the NetworkArrays it was made from."""
+
+    def __init__(self, network_arrays, cell_size):
+        self.cell_size = cell_size
+
+        # Leave out the holes of removed waypoints
+        present = np.flatnonzero(~np.isnan(network_arrays.positions[:, 0]))
+        positions = network_arrays.positions[present]
+        cells = np.floor(positions / cell_size).astype(np.int64)
+
+        unique_cells, membership, self._counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        membership = membership.reshape(-1)
+        self.cluster_count = len(self._counts)
+
+        # Cell -> cluster, and the waypoint rows in every cluster
+        self._cluster_of_cell = {tuple(cell): c for c, cell in enumerate(unique_cells.reshape(-1, 2).tolist())}
+        self._members = []
+
+        start = 0
+        grouped_rows = present[np.argsort(membership, kind="stable")].tolist()
+
+        for count in self._counts.tolist():
+            self._members.append(set(grouped_rows[start:start + count]))
+            start += count
+
+        # Clusters sit in the middle of their waypoints
+        self._sums = np.column_stack((
+            np.bincount(membership, weights=positions[:, 0], minlength=self.cluster_count),
+            np.bincount(membership, weights=positions[:, 1], minlength=self.cluster_count)
+        )).reshape(-1, 2)
+        self._positions = self._sums / self._counts.reshape(-1, 1)
+
+        # The first waypoint of each cluster, drawn instead of a marker when it's alone
+        self._representatives = np.zeros(self.cluster_count, dtype=np.intp)
+        self._representatives[membership[::-1]] = present[::-1]
+
+        # Waypoint row -> its cluster, -1 for holes
+        self._membership = np.full(len(network_arrays.positions), -1, dtype=np.intp)
+        self._membership[present] = membership
+
+        # Lines between clusters. Lines inside a cluster disappear, parallel lines become one.
+        line_endpoints = np.sort(self._membership[network_arrays.line_endpoints], axis=1).reshape(-1, 2)
+        between = line_endpoints[:, 0] != line_endpoints[:, 1]
+
+        self._line_endpoints, line_membership = np.unique(line_endpoints[between], axis=0, return_inverse=True)
+        self._line_endpoints = self._line_endpoints.reshape(-1, 2)
+        line_membership = line_membership.reshape(-1)
+        self.line_count = len(self._line_endpoints)
+
+        # Normal and walkable lines in every cluster line, so removing one can tell whether the cluster line goes
+        self._line_counts = np.zeros((self.line_count, 2), dtype=np.int64)
+        np.add.at(self._line_counts, (line_membership, (network_arrays.line_types[between] != 0).astype(np.intp)), 1)
+
+        # A cluster line is a normal line if any of its lines is one, otherwise it's walkable
+        self._line_types = np.where(self._line_counts[:, 0] > 0, 0, 1).astype(np.int8)
+
+        # (cluster, cluster) -> row in the line arrays
+        self._line_rows = {tuple(key): row for row, key in enumerate(self._line_endpoints.tolist())}
+
+    @property
+    def counts(self):
+        return self._counts[:self.cluster_count]
+
+    @property
+    def positions(self):
+        return self._positions[:self.cluster_count]
+
+    @property
+    def representatives(self):
+        return self._representatives[:self.cluster_count]
+
+    @property
+    def line_endpoints(self):
+        return self._line_endpoints[:self.line_count]
+
+    @property
+    def line_types(self):
+        return self._line_types[:self.line_count]
+
+    def add_waypoint(self, i, pos):
+        cell = (math.floor(pos[0] / self.cell_size), math.floor(pos[1] / self.cell_size))
+        c = self._cluster_of_cell.get(cell)
+
+        if c is None:
+            c = self.cluster_count
+            self.cluster_count += 1
+
+            for array in ("_counts", "_sums", "_positions", "_representatives"):
+                setattr(self, array, _with_room(getattr(self, array), self.cluster_count))
+
+            self._counts[c] = 0
+            self._sums[c] = 0
+            self._cluster_of_cell[cell] = c
+            self._members.append(set())
+
+        # New rows come last, so they're only the first waypoint of a cluster that had none
+        if not self._members[c]:
+            self._representatives[c] = i
+
+        self._members[c].add(i)
+
+        self._membership = _with_room(self._membership, i + 1)
+        self._membership[i] = c
+
+        self._counts[c] += 1
+        self._sums[c] += pos
+        self._positions[c] = self._sums[c] / self._counts[c]
+
+    def remove_waypoint(self, i, pos):
+        """Its lines have to be removed first. Emptied clusters stay, with a NaN position so they're never drawn"""
+        c = int(self._membership[i])
+        self._membership[i] = -1
+        self._members[c].discard(i)
+
+        self._counts[c] -= 1
+        self._sums[c] -= pos
+
+        if self._counts[c] == 0:
+            self._positions[c] = np.nan
+            return
+
+        self._positions[c] = self._sums[c] / self._counts[c]
+
+        if self._representatives[c] == i:
+            self._representatives[c] = min(self._members[c])
+
+    def add_line(self, i, j, line_type):
+        key = self._line_key(i, j)
+
+        if key is None:
+            return
+
+        row = self._line_rows.get(key)
+
+        if row is None:
+            row = self.line_count
+            self.line_count += 1
+
+            for array in ("_line_endpoints", "_line_counts", "_line_types"):
+                setattr(self, array, _with_room(getattr(self, array), self.line_count))
+
+            self._line_endpoints[row] = key
+            self._line_counts[row] = 0
+            self._line_rows[key] = row
+
+        self._line_counts[row, int(line_type != 0)] += 1
+        self._line_types[row] = 0 if self._line_counts[row, 0] > 0 else 1
+
+    def remove_line(self, i, j, line_type):
+        key = self._line_key(i, j)
+        row = self._line_rows.get(key) if key is not None else None
+
+        if row is None:
+            return
+
+        self._line_counts[row, int(line_type != 0)] -= 1
+
+        if self._line_counts[row].any():
+            self._line_types[row] = 0 if self._line_counts[row, 0] > 0 else 1
+            return
+
+        # The last of its lines is gone, move the last cluster line into the hole
+        del self._line_rows[key]
+        last = self.line_count - 1
+
+        if row != last:
+            for array in (self._line_endpoints, self._line_counts, self._line_types):
+                array[row] = array[last]
+
+            self._line_rows[tuple(self._line_endpoints[row].tolist())] = row
+
+        self.line_count -= 1
+
+    def _line_key(self, i, j):
+        """The clusters a line between two waypoint rows connects, or None if it's inside one"""
+        a, b = sorted((int(self._membership[i]), int(self._membership[j])))
+
+        return (a, b) if a != b else None
+
+class PlayerTracks:
+    """Player positions as NumPy arrays. Every player glides from where it was drawn to where the feed last put it,
+    taking as long as the feed took between its last two updates, so it arrives about when the next one comes in."""
+
+    def __init__(self, max_glide_time, teleport_distance):
+        self.max_glide_time = max_glide_time # Seconds. Players that weren't updated for longer still only take this long.
+        self.teleport_distance = teleport_distance # Players that moved further than this jump instead of gliding
+
+        self.names = []
+        self.index = {} # Name -> row
+
+        self._starts = np.empty((0, 2))
+        self._targets = np.empty((0, 2))
+        self._start_times = np.empty(0)
+        self._glide_times = np.empty(0)
+
+    def update(self, name, pos, now):
+        i = self.index.get(name)
+
+        if i is None:
+            i = len(self.names)
+
+            for array in ("_starts", "_targets", "_start_times", "_glide_times"):
+                setattr(self, array, _with_room(getattr(self, array), i + 1))
+
+            self.index[name] = i
+            self.names.append(name)
+
+            self._starts[i] = pos
+            glide_time = 0
+        else:
+            start = self.positions([i], now)[0]
+            glide_time = min(now - self._start_times[i], self.max_glide_time)
+
+            if np.hypot(*(start - pos)) > self.teleport_distance:
+                start = pos
+                glide_time = 0
+
+            self._starts[i] = start
+
+        self._targets[i] = pos
+        self._start_times[i] = now
+        self._glide_times[i] = glide_time
+
+    def remove(self, name):
+        # Players that left in the same frame they first moved in were never added
+        i = self.index.pop(name, None)
+
+        if i is None:
+            return
+
+        last = len(self.names) - 1
+
+        # Move the last player into the hole
+        if i != last:
+            self.names[i] = self.names[last]
+            self.index[self.names[i]] = i
+
+            for array in (self._starts, self._targets, self._start_times, self._glide_times):
+                array[i] = array[last]
+
+        self.names.pop()
+
+    def positions(self, rows, now):
+        """Where the players in rows (a list or array of row numbers) are at time now, as an (n, 2) array"""
+        rows = np.asarray(rows, dtype=np.intp)
+        glide_times = self._glide_times[rows]
+
+        progress = np.ones(len(rows))
+        gliding = glide_times > 0
+        progress[gliding] = np.minimum((now - self._start_times[rows][gliding]) / glide_times[gliding], 1)
+
+        starts = self._starts[rows]
+
+        return starts + (self._targets[rows] - starts) * progress.reshape(-1, 1)
+
+def apply_camera(positions, camera_x, camera_y, camera_zoom, width, height):
+    """Vectorized version of display.apply_camera, for an (n, 2) array of world positions"""
+    return (positions - (camera_x, camera_y)) * camera_zoom + (width / 2, height / 2)
+
+def points_in_rect(positions, min_x, min_y, max_x, max_y):
+    return (positions[:, 0] >= min_x) & (positions[:, 0] <= max_x) & (positions[:, 1] >= min_y) & (positions[:, 1] <= max_y)
+
+def segments_in_rect(starts, ends, min_x, min_y, max_x, max_y):
+    """Mask of the segments that touch the rectangle"""
+
+    # The bounding boxes have to overlap...
+    mask = (np.minimum(starts[:, 0], ends[:, 0]) <= max_x) & (np.maximum(starts[:, 0], ends[:, 0]) >= min_x) \
+         & (np.minimum(starts[:, 1], ends[:, 1]) <= max_y) & (np.maximum(starts[:, 1], ends[:, 1]) >= min_y)
+
+    # ...and the rectangle's corners can't all be on the same side of the line
+    direction = ends - starts
+
+    sides = [
+        direction[:, 0] * (corner_y - starts[:, 1]) - direction[:, 1] * (corner_x - starts[:, 0])
+        for corner_x, corner_y in ((min_x, min_y), (max_x, min_y), (min_x, max_y), (max_x, max_y))
+    ]
+
+    all_positive = np.all([side > 0 for side in sides], axis=0)
+    all_negative = np.all([side < 0 for side in sides], axis=0)
+
+    return mask & ~all_positive & ~all_negative
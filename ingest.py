@@ -0,0 +1,192 @@
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+
+import network
+
+# What pull_data.py is made of. Sources yield records (waypoint dicts and Line records), which are merged into
+# waypoints.json-style data one at a time. Sources are fetched at the same time on a thread pool, but merged in
+# order, so the output is the same every run.
+
+# A line between two waypoints, referred to by "Type - Name" (like lines.json does) or by network.waypoint_identity
+Line = collections.namedtuple("Line", ("p1", "p2", "type"))
+
+class Source:
+    """Somewhere waypoints and lines come from. Subclass it for a new network, see the README"""
+
+    @property
+    def name(self):
+        """Tells sources apart in the cache"""
+        return type(self).__name__
+
+    def fetch(self, cache):
+        """Does the slow part (downloading, ...) on a worker thread, and tells cache (a refresh.SourceCache) if anything changed.
+        Whatever it returns is passed to records(). Sources that can't tell always count as changed"""
+        cache.always_changed(self.name)
+
+    def records(self, fetched):
+        """Yields waypoint dicts and Line records"""
+        raise NotImplementedError
+
+class FileSource(Source):
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def name(self):
+        return self.path
+
+    def fetch(self, cache):
+        cache.file_changed(self.path)
+
+class UrlSource(Source):
+    def __init__(self, url):
+        self.url = url
+
+    @property
+    def name(self):
+        return self.url
+
+    def fetch(self, cache):
+        return cache.fetch(self.url)
+
+class XaeroSource(FileSource):
+    """Waypoints gathered with Xaero's Minimap, named "Type - Name". AirCS ones are left out, AirCSSource has better data"""
+
+    def records(self, fetched):
+        with open(self.path, "r") as f:
+            reader = csv.reader(filter(lambda row: not row.startswith("#"), f), delimiter=":")
+
+            for row in reader:
+                if row[0] == "waypoint":
+                    type_, name = row[1].split(" - ")
+
+                    if type_ != "AirCS":
+                        yield {
+                            "id": network.stable_id(network.waypoint_identity(type_, name)),
+                            "type": type_,
+                            "name": name,
+                            "pos": [
+                                int(row[3]),
+                                int(row[5])
+                            ]
+                        }
+
+class AirCSSource(UrlSource):
+    """Stations and the lines between them from the AirCS map"""
+
+    def records(self, fetched):
+        stations = json.loads(fetched)["stations"]
+
+        # Skip bad stations
+        good_stations = {
+            station_id for station_id, station in stations.items()
+            if station["name"] is not None and station["cx"] is not None and station["cz"] is not None and len(station["platforms"]) != 0
+        }
+
+        identities = {}
+
+        for station_id, station in stations.items():
+            if station_id in good_stations:
+                identities[station_id] = network.waypoint_identity("AirCS", station["name"], station_id)
+
+                yield {
+                    "id": network.stable_id(identities[station_id]),
+                    "type": "AirCS",
+                    "_aircsId": station_id,
+                    "name": station["name"],
+                    "pos": [
+                        station["cx"],
+                        station["cz"]
+                    ]
+                }
+
+        for station_id, station in stations.items():
+            if station_id not in good_stations:
+                continue
+
+            for platform in station["platforms"].values():
+                if platform["station"] not in good_stations:
+                    continue
+
+                if platform["station"] == station_id: # VICTOR WHY??????? WHY????????
+                    continue
+
+                yield Line(identities[station_id], identities[platform["station"]], 0)
+
+def _cycle(*points):
+    return list(zip(points, points[1:] + points[:1]))
+
+# lines.json line type -> (line type, function from the entry to the pairs of waypoints it connects)
+LOCAL_LINE_SHAPES = {
+    "walkable_quadruplet": (1, lambda l: _cycle(l["p1"], l["p2"], l["p3"]) + [(l["p3"], l["p4"]), (l["p4"], l["p1"]), (l["p4"], l["p2"])]),
+    "walkable_triplet": (1, lambda l: _cycle(l["p1"], l["p2"], l["p3"])),
+    "normal": (0, lambda l: [(l["p1"], l["p2"])]),
+    "walkable": (1, lambda l: [(l["p1"], l["p2"])]),
+    "polygonal": (0, lambda l: list(zip(l["waypoints"], l["waypoints"][1:])))
+}
+
+class LocalLinesSource(FileSource):
+    """Lines from lines.json, see the README for its format"""
+
+    def records(self, fetched):
+        with open(self.path, "r") as f:
+            local_line_data = json.load(f)
+
+        for l in local_line_data:
+            if l["type"] in LOCAL_LINE_SHAPES:
+                line_type, pairs = LOCAL_LINE_SHAPES[l["type"]]
+
+                for p1, p2 in pairs(l):
+                    yield Line(p1, p2, line_type)
+
+def fetch_all(sources, cache):
+    """Fetches every source at the same time. Returns what their fetch() returned, in order"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(sources))) as pool:
+        fetched = list(pool.map(lambda source: source.fetch(cache), sources))
+
+    cache.keep_only([source.name for source in sources])
+
+    return fetched
+
+def merge(sources, fetched):
+    """Merges the records of every source, in order, into waypoints.json-style data"""
+    data = {
+        "waypoints": [],
+        "lines": []
+    }
+
+    references = {} # "Type - Name" and waypoint identity -> waypoint ID, of the first waypoint if there are several
+    missing = set() # References that weren't found, so each is only complained about once
+    line_keys = set() # (network.line_key of the endpoints, type) of every line, so reversed duplicates match too
+
+    records = itertools.chain.from_iterable(source.records(result) for source, result in zip(sources, fetched))
+
+    for record in records:
+        if not isinstance(record, Line):
+            data["waypoints"].append(record)
+
+            references.setdefault(record["type"] + " - " + record["name"], record["id"])
+            references.setdefault(network.waypoint_identity(record["type"], record["name"], record.get("_aircsId")), record["id"])
+
+            continue
+
+        # Lines can only refer to waypoints that came before them
+        for reference in (record.p1, record.p2):
+            if reference not in references and reference not in missing:
+                print("Couldn't find identifier:", reference)
+                missing.add(reference)
+
+        p1_id = references.get(record.p1)
+        p2_id = references.get(record.p2)
+
+        # Keep the first line if there are duplicates, either way round
+        key = (network.line_key(p1_id, p2_id), record.type)
+
+        if key not in line_keys:
+            line_keys.add(key)
+            data["lines"].append({"p1": p1_id, "p2": p2_id, "type": record.type})
+
+    return data
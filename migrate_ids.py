@@ -0,0 +1,68 @@
+import argparse
+import os
+
+import network
+import network_file
+import routing
+import saving
+
+# Gives the waypoints of a file made by an older pull_data.py their stable IDs (see network.stable_id), in place.
+# The precomputed routing data next to it is carried over to the new IDs, as long as it still matched the file.
+
+parser = argparse.ArgumentParser(description="Switch a waypoints file over to stable waypoint IDs")
+parser.add_argument("path", nargs="?", default="waypoints.json")
+args = parser.parse_args()
+
+data = network_file.read_network(args.path)
+saving.replay_journal(data, args.path)
+
+old_fingerprint = routing.RoutingGraph(data).fingerprint()
+
+new_ids = network.migrate_ids(data)
+
+if not new_ids:
+    raise SystemExit(f"{args.path} already has stable IDs")
+
+# The journal was replayed into data and uses the old IDs, so it goes
+network_file.write_network(data, args.path)
+
+if os.path.exists(saving.journal_path(args.path)):
+    os.remove(saving.journal_path(args.path))
+
+print("Changed %d of %d waypoint IDs" % (len(new_ids), len(data["waypoints"])))
+
+new_fingerprint = routing.RoutingGraph(data).fingerprint()
+
+# The hierarchy goes by waypoint index and only needs its fingerprint changed, the cost matrix has IDs in it as well
+try:
+    hierarchy = routing.ContractionHierarchy.load(routing.hierarchy_path(args.path))
+except FileNotFoundError:
+    hierarchy = None
+
+if hierarchy is not None:
+    if hierarchy.fingerprint == old_fingerprint:
+        hierarchy.fingerprint = new_fingerprint
+        hierarchy.save(routing.hierarchy_path(args.path))
+
+        print("Updated", routing.hierarchy_path(args.path))
+    else:
+        print(routing.hierarchy_path(args.path), "was already out of date, run routing.py again")
+
+try:
+    matrix = routing.CostMatrix.load(routing.cost_matrix_path(args.path))
+except FileNotFoundError:
+    matrix = None
+
+if matrix is not None:
+    if matrix.fingerprint == old_fingerprint:
+        matrix = routing.CostMatrix(
+            [new_ids.get(w_id, w_id) for w_id in matrix.source_ids],
+            [new_ids.get(w_id, w_id) for w_id in matrix.target_ids],
+            matrix.costs,
+            new_fingerprint
+        )
+        matrix.save(routing.cost_matrix_path(args.path))
+
+        print("Updated", routing.cost_matrix_path(args.path))
+    else:
+        print(routing.cost_matrix_path(args.path), "was already out of date, run routing.py again")
@@ -0,0 +1,164 @@
+import collections.abc
+import hashlib
+import operator
+
+def stable_id(identity):
+    """64-bit signed waypoint ID derived from a string, the same in every run (unlike hash(), which is salted per process)"""
+    return int.from_bytes(hashlib.blake2b(identity.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+def waypoint_identity(type_, name, aircs_id=None):
+    """What identifies a waypoint across data refreshes. AirCS stations by their own ID, so renaming one keeps its ID"""
+    if aircs_id is not None:
+        return f"AirCS ({aircs_id})"
+
+    return f"{type_} - {name}"
+
+def stable_waypoint_id(w):
+    return stable_id(waypoint_identity(w["type"], w["name"], w.get("_aircsId")))
+
+def migrate_ids(data):
+    """Gives every waypoint its stable ID, and updates the lines to match. Returns old ID -> new ID of the ones that changed"""
+    new_ids = {}
+
+    for w in data["waypoints"]:
+        new_id = stable_waypoint_id(w)
+
+        if new_id != w["id"]:
+            new_ids[w["id"]] = new_id
+            w["id"] = new_id
+
+    for l in data["lines"]:
+        l["p1"] = new_ids.get(l["p1"], l["p1"])
+        l["p2"] = new_ids.get(l["p2"], l["p2"])
+
+    return new_ids
+
+def line_key(w1_id, w2_id):
+    """Key of the line between two waypoints, regardless of direction"""
+    return frozenset((w1_id, w2_id))
+
+class NetworkIndex:
+    """Lookup tables for waypoints by ID and lines by their (unordered) endpoints.
+    Edits made through it are applied to data as well, without scanning its lists."""
+
+    def __init__(self, data, columns=None):
+        self.data = data
+
+        # Where every waypoint sits in data's list, by ID, so it can be found and removed in O(1)
+        if columns is not None:
+            # Straight from a network_file.NetworkFile of the same data, without building every waypoint
+            self.waypoint_slots = dict(zip(columns.ids.tolist(), range(len(columns.ids))))
+        else:
+            self.waypoint_slots = {w["id"]: i for i, w in enumerate(data["waypoints"])}
+
+        self.waypoints = _WaypointsById(self) # Waypoint ID -> waypoint
+
+        # Lines are only looked up when editing, so their tables are built the first time they're needed
+        self.lines = None # line_key -> every line between those waypoints (they can differ in type), in data's order
+        self.neighbours = None # Waypoint ID -> IDs of the waypoints it has a line to
+        self.line_slots = None # id() of a line -> where it sits in data's list (there can be equal copies)
+
+    def index_lines(self):
+        if self.lines is not None:
+            return
+
+        self.lines = {}
+        self.neighbours = {}
+        self.line_slots = {id(l): i for i, l in enumerate(self.data["lines"])}
+
+        for l in self.data["lines"]:
+            self._index_line(l)
+
+    def _index_line(self, line):
+        key = line_key(line["p1"], line["p2"])
+
+        if key not in self.lines:
+            self.lines[key] = []
+            self.neighbours.setdefault(line["p1"], set()).add(line["p2"])
+            self.neighbours.setdefault(line["p2"], set()).add(line["p1"])
+
+        self.lines[key].append(line)
+
+    def add_line(self, line):
+        if self.lines is not None:
+            self.line_slots[id(line)] = len(self.data["lines"])
+            self._index_line(line)
+
+        self.data["lines"].append(line)
+
+    def remove_line(self, line):
+        self.index_lines()
+
+        key = line_key(line["p1"], line["p2"])
+        lines = self.lines.get(key, [])
+
+        # By identity, there can be equal copies. The next line (if any) moves up, like it would in a linear scan.
+        for i, l in enumerate(lines):
+            if l is line:
+                del lines[i]
+                break
+
+        if not lines and key in self.lines:
+            del self.lines[key]
+            self.neighbours[line["p1"]].discard(line["p2"])
+            self.neighbours[line["p2"]].discard(line["p1"])
+
+        _swap_remove(self.data["lines"], self.line_slots, line)
+
+    def add_waypoint(self, waypoint):
+        self.waypoint_slots[waypoint["id"]] = len(self.data["waypoints"])
+        self.data["waypoints"].append(waypoint)
+
+    def replace_waypoint(self, old, new):
+        """Puts new (with the same ID) where old was, keeping its lines"""
+        self.data["waypoints"][self.waypoint_slots[old["id"]]] = new
+
+    def remove_waypoint(self, waypoint):
+        """Removes a waypoint. Its lines have to be removed first"""
+        if self.neighbours is not None:
+            self.neighbours.pop(waypoint["id"], None)
+
+        _swap_remove(self.data["waypoints"], self.waypoint_slots, waypoint, operator.itemgetter("id"))
+
+    def find_line(self, w1_id, w2_id, type_=None):
+        """The first line between two waypoints (of a type, if given), or None"""
+        self.index_lines()
+
+        for l in self.lines.get(line_key(w1_id, w2_id), ()):
+            if type_ is None or l.get("type") == type_:
+                return l
+
+        return None
+
+    def find_lines_of(self, w_id):
+        """Every line of a waypoint, including parallel ones"""
+        self.index_lines()
+
+        return [l for other_id in self.neighbours.get(w_id, ()) for l in self.lines[line_key(w_id, other_id)]]
+
+class _WaypointsById(collections.abc.Mapping):
+    """Waypoint ID -> waypoint, looked up in data's list through the slots. Only builds the waypoints asked for (see network_file.Rows)"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, w_id):
+        return self.index.data["waypoints"][self.index.waypoint_slots[w_id]]
+
+    def __contains__(self, w_id):
+        return w_id in self.index.waypoint_slots
+
+    def __iter__(self):
+        return iter(self.index.waypoint_slots)
+
+    def __len__(self):
+        return len(self.index.waypoint_slots)
+
+def _swap_remove(items, slots, item, key=id):
+    """Removes item from a list in O(1) by moving the last item into its place. slots maps key(item) to where it is"""
+    i = slots.pop(key(item))
+    last = items.pop()
+
+    if last is not item:
+        items[i] = last
+        slots[key(last)] = i
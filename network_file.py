@@ -0,0 +1,352 @@
+import argparse
+import collections.abc
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Compact columnar storage for waypoints.json-style networks, loaded by memory-mapping instead of parsing.
+#
+# Layout: MAGIC, the header length as a little endian uint64, a JSON header, then every array at an offset
+# that's a multiple of ALIGNMENT. The header lists each array's dtype, shape and offset.
+
+MAGIC = b"WPNET\0\0\1"
+ALIGNMENT = 64
+EXTENSION = ".wpnet"
+
+WAYPOINT_KEYS = ("id", "type", "name", "pos")
+LINE_KEYS = ("p1", "p2", "type")
+
+class NetworkFile:
+    """A memory-mapped network. Arrays are read from disk as they're used, strings are decoded as they're needed"""
+
+    def __init__(self, path):
+        self.path = path
+        self.map = np.memmap(path, dtype=np.uint8, mode="r")
+
+        if bytes(self.map[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a network file")
+
+        header_size = int(np.frombuffer(self.map, dtype="<u8", count=1, offset=len(MAGIC))[0])
+        self.header = json.loads(bytes(self.map[len(MAGIC) + 8:len(MAGIC) + 8 + header_size]))
+
+        for name, (dtype, shape, offset) in self.header["arrays"].items():
+            count = int(np.prod(shape))
+
+            if count:
+                setattr(self, name, np.frombuffer(self.map, dtype=dtype, count=count, offset=offset).reshape(shape))
+            else:
+                setattr(self, name, np.zeros(shape, dtype=dtype))
+
+        # Waypoints and lines that don't fit the columns, stored as they were. Row (as a string, it's JSON) -> dict.
+        self.irregular_waypoints = self.header["irregular_waypoints"]
+        self.irregular_lines = self.header["irregular_lines"]
+
+        self.strings = {} # Index in the string table -> the string, once it was decoded
+
+    def to_data(self):
+        """The network as waypoints.json-style data. Its lists are Rows, so a waypoint or line (and its name) is only
+        turned into a dict when something reads it, and this takes the same time however big the network is"""
+        waypoints = Rows(self._waypoint, list(range(len(self.ids))))
+        lines = Rows(self._line, list(range(len(self.line_ids))))
+
+        for i, w in self.irregular_waypoints.items():
+            waypoints[int(i)] = w
+
+        for i, l in self.irregular_lines.items():
+            lines[int(i)] = l
+
+        everything = {**self.header["extra"], "waypoints": waypoints, "lines": lines}
+
+        return {key: everything[key] for key in self.header["keys"]}
+
+    def waypoint_types(self):
+        """Type of every waypoint, without building the waypoints"""
+        types = {type_index: self._string(type_index) for type_index in np.unique(self.type_indexes).tolist()}
+        waypoint_types = [types[type_index] for type_index in self.type_indexes.tolist()]
+
+        for i, w in self.irregular_waypoints.items():
+            waypoint_types[int(i)] = w["type"]
+
+        return waypoint_types
+
+    def waypoint_names(self):
+        """ID, type and name of every waypoint (all a search.NameIndex needs), without building the waypoints. Decoded as it's iterated"""
+        for i, (w_id, type_index, name_index) in enumerate(zip(self.ids.tolist(), self.type_indexes.tolist(), self.name_indexes.tolist())):
+            w = self.irregular_waypoints.get(str(i))
+
+            if w is None:
+                w = {"id": w_id, "type": self._string(type_index), "name": self._string(name_index)}
+
+            yield w
+
+    def _string(self, n):
+        string = self.strings.get(n)
+
+        if string is None:
+            start, end = self.string_offsets[n:n + 2].tolist()
+            string = self.strings[n] = bytes(self.string_data[start:end]).decode("utf-8")
+
+        return string
+
+    def _waypoint(self, row):
+        pos = self.positions[row].tolist()
+
+        # Coordinates go back to ints where they were ints
+        for axis, is_integer in enumerate(self.integer_positions[row].tolist()):
+            if is_integer:
+                pos[axis] = int(pos[axis])
+
+        return {"id": self.ids.item(row), "type": self._string(self.type_indexes.item(row)), "name": self._string(self.name_indexes.item(row)), "pos": pos}
+
+    def _line(self, row):
+        p1, p2 = self.line_ids[row].tolist()
+
+        return {"p1": p1, "p2": p2, "type": self.line_types.item(row)}
+
+class Rows(collections.abc.MutableSequence):
+    """A list of waypoints or lines that builds each dict from the columns the first time it's read, and is a plain list otherwise.
+    Copies share what was built, so a row is the same dict whichever copy it's read through (even on another thread)."""
+
+    def __init__(self, build, items, built=None):
+        self._build = build # Row -> a new dict of it
+        self._items = items # Dicts, or the rows of the ones that weren't read yet
+        self._built = {} if built is None else built # Row -> its dict, once it was read through any copy
+
+    def _get(self, i):
+        item = self._items[i]
+
+        if type(item) is int:
+            row = item
+            item = self._built.get(row)
+
+            if item is None:
+                # Whichever thread got there first wins
+                item = self._built.setdefault(row, self._build(row))
+
+            self._items[i] = item
+
+        return item
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get(n) for n in range(*i.indices(len(self._items)))]
+
+        return self._get(i)
+
+    def __setitem__(self, i, item):
+        self._items[i] = item
+
+    def __delitem__(self, i):
+        del self._items[i]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        i = 0
+
+        while i < len(self._items):
+            yield self._get(i)
+            i += 1
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def insert(self, i, item):
+        self._items.insert(i, item)
+
+    def copy(self):
+        return self.select(range(len(self._items)))
+
+    def select(self, rows):
+        """A copy of only the items at rows (in that order), without building them"""
+        return Rows(self._build, [self._items[i] for i in rows], self._built)
+
+def load(path):
+    return NetworkFile(path)
+
+def save(data, path):
+    """Writes a waypoints.json-style network. Anything the columns can't hold exactly is kept in the header instead"""
+    waypoints = data["waypoints"]
+    lines = data["lines"]
+
+    strings = {}
+    irregular_waypoints = {}
+    irregular_lines = {}
+
+    def intern(string):
+        return strings.setdefault(string, len(strings))
+
+    ids = np.zeros(len(waypoints), dtype=np.int64)
+    positions = np.full((len(waypoints), 2), np.nan)
+    integer_positions = np.zeros((len(waypoints), 2), dtype=bool)
+    type_indexes = np.zeros(len(waypoints), dtype=np.int32)
+    name_indexes = np.zeros(len(waypoints), dtype=np.int32)
+
+    for i, w in enumerate(waypoints):
+        if not _is_regular_waypoint(w):
+            irregular_waypoints[str(i)] = w
+            continue
+
+        ids[i] = w["id"]
+        positions[i] = w["pos"]
+        integer_positions[i] = [type(v) is int for v in w["pos"]]
+        type_indexes[i] = intern(w["type"])
+        name_indexes[i] = intern(w["name"])
+
+    line_ids = np.zeros((len(lines), 2), dtype=np.int64)
+    line_types = np.zeros(len(lines), dtype=np.int8)
+
+    for i, l in enumerate(lines):
+        if not _is_regular_line(l):
+            irregular_lines[str(i)] = l
+            continue
+
+        line_ids[i] = (l["p1"], l["p2"])
+        line_types[i] = l["type"]
+
+    # Lines as waypoint rows as well, so they don't have to be looked up by ID after loading. -1 is a missing waypoint.
+    line_ends = np.full((len(lines), 2), -1, dtype=np.int64)
+
+    if len(lines) and len(waypoints):
+        order = np.argsort(ids, kind="stable")
+        found = np.minimum(np.searchsorted(ids, line_ids, sorter=order), len(ids) - 1)
+        rows = order[found]
+        exists = ids[rows] == line_ids
+
+        for i in irregular_waypoints:
+            exists &= rows != int(i)
+
+        for i in irregular_lines:
+            exists[int(i)] = False
+
+        line_ends[exists] = rows[exists]
+
+    encoded = [string.encode("utf-8") for string in strings]
+
+    arrays = {
+        "ids": ids,
+        "positions": positions,
+        "integer_positions": integer_positions,
+        "type_indexes": type_indexes,
+        "name_indexes": name_indexes,
+        "line_ids": line_ids,
+        "line_ends": line_ends,
+        "line_types": line_types,
+        "string_offsets": np.cumsum([0] + [len(string) for string in encoded], dtype=np.int64),
+        "string_data": np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    }
+
+    header = {
+        "arrays": {},
+        "irregular_waypoints": irregular_waypoints,
+        "irregular_lines": irregular_lines,
+        "extra": {key: value for key, value in data.items() if key not in ("waypoints", "lines")},
+        "keys": list(data) # In their original order
+    }
+
+    # Offsets depend on the header's length and the header contains the offsets, so give it room to spare
+    header_room = len(json.dumps(header)) + 128 * len(arrays) + ALIGNMENT
+    offset = _align(len(MAGIC) + 8 + header_room)
+
+    for name, array in arrays.items():
+        header["arrays"][name] = (array.dtype.str, array.shape, offset)
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header_room)
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.array([len(header_bytes)], dtype="<u8").tobytes())
+        f.write(header_bytes)
+
+        for name, array in arrays.items():
+            f.seek(header["arrays"][name][2])
+            f.write(np.ascontiguousarray(array).tobytes())
+
+        # Pad the end too, so the last array is never cut short
+        f.truncate(offset)
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _is_int64(value):
+    return type(value) is int and -2 ** 63 <= value < 2 ** 63
+
+def _is_exact_coordinate(value):
+    # Floats are stored as they are, ints only if a float64 holds them exactly
+    return type(value) is float or (type(value) is int and float(value) == value)
+
+def _is_regular_waypoint(w):
+    return (
+        tuple(w) == WAYPOINT_KEYS
+        and _is_int64(w["id"])
+        and type(w["type"]) is str and type(w["name"]) is str
+        and type(w["pos"]) is list and len(w["pos"]) == 2 and all(_is_exact_coordinate(v) for v in w["pos"])
+    )
+
+def _is_regular_line(l):
+    return tuple(l) == LINE_KEYS and _is_int64(l["p1"]) and _is_int64(l["p2"]) and type(l["type"]) is int and -128 <= l["type"] < 128
+
+def _list_rows(value):
+    if isinstance(value, Rows):
+        return list(value)
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def read_network(path):
+    """Loads waypoints.json-style data from either format, by extension"""
+    if path.endswith(EXTENSION):
+        return load(path).to_data()
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+def write_network(data, path):
+    """Writes either format, by extension. Goes through a temporary file, so path always holds either the old or the new network, even after a crash"""
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=name + ".", suffix=".tmp")
+
+    try:
+        if path.endswith(EXTENSION):
+            os.close(fd)
+            save(data, temp_path)
+
+            fd = os.open(temp_path, os.O_RDONLY)
+            os.fsync(fd)
+            os.close(fd)
+        else:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=4, default=_list_rows)
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Convert a network between JSON and the {EXTENSION} format, by extension")
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    args = parser.parse_args()
+
+    data = read_network(args.source)
+    write_network(data, args.destination)
+
+    # Make sure nothing got lost on the way
+    if read_network(args.destination) != data:
+        raise SystemExit(f"{args.destination} doesn't match {args.source}, please report this")
+
+    print("Converted %d waypoints and %d lines, %d -> %d bytes" % (len(data["waypoints"]), len(data["lines"]), os.path.getsize(args.source), os.path.getsize(args.destination)))
@@ -0,0 +1,114 @@
+import collections
+import csv
+import json
+import time
+
+# Phases of a frame, in the order they happen. Static layer phases only take time on frames that redraw it.
+PHASES = ("events", "update players", "route preview", "lines", "waypoints", "labels", "static layer", "path", "players", "overlay", "flip")
+
+# Things counted per frame
+COUNTERS = ("lines drawn", "lines culled", "waypoints drawn", "waypoints culled", "players drawn", "players culled", "feed queue", "feed superseded", "logo cache hit %", "label cache hit %")
+
+PROFILER_WINDOW = 300 # Frames the rolling percentiles are computed over
+
+class FrameProfiler:
+    """Times the phases of every frame and keeps rolling statistics. Does nothing unless the HUD is shown or a trace is written"""
+
+    def __init__(self, trace_path=None):
+        self.show_hud = False
+
+        # Trace file, as CSV if the name ends in .csv and JSON lines otherwise
+        self.trace_file = None
+        self.trace_writer = None
+
+        if trace_path is not None:
+            self.trace_file = open(trace_path, "w", newline="")
+
+            if trace_path.endswith(".csv"):
+                self.trace_writer = csv.DictWriter(self.trace_file, fieldnames=("frame", "total") + PHASES + COUNTERS, restval=0)
+                self.trace_writer.writeheader()
+
+        self.frame = 0
+        self.last_time = 0
+
+        self.durations = {} # Phase -> seconds, for the current frame
+        self.counters = {} # Counter -> value, kept between frames until something sets it again
+
+        self.history = {phase: collections.deque(maxlen=PROFILER_WINDOW) for phase in ("total",) + PHASES}
+
+    @property
+    def enabled(self):
+        return self.show_hud or self.trace_file is not None
+
+    def start_frame(self):
+        if not self.enabled:
+            return
+
+        self.durations = {}
+        self.last_time = time.perf_counter()
+
+    def mark(self, phase):
+        """Ends a phase. It's credited with everything since the previous mark"""
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        self.durations[phase] = self.durations.get(phase, 0) + now - self.last_time
+        self.last_time = now
+
+    def count(self, counter, value):
+        if not self.enabled:
+            return
+
+        self.counters[counter] = value
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+
+        self.frame += 1
+
+        total = sum(self.durations.values())
+        self.history["total"].append(total)
+
+        for phase in PHASES:
+            self.history[phase].append(self.durations.get(phase, 0))
+
+        if self.trace_file is not None:
+            row = {"frame": self.frame, "total": total * 1000, **{phase: duration * 1000 for phase, duration in self.durations.items()}, **self.counters}
+
+            if self.trace_writer is not None:
+                self.trace_writer.writerow(row)
+            else:
+                self.trace_file.write(json.dumps(row) + "\n")
+
+    def percentiles(self, phase):
+        """Returns the rolling (p50, p95, p99) of a phase, in milliseconds"""
+        durations = sorted(self.history[phase])
+
+        if not durations:
+            return (0, 0, 0)
+
+        return tuple(durations[min(len(durations) - 1, int(len(durations) * p))] * 1000 for p in (0.5, 0.95, 0.99))
+
+    def hud_lines(self):
+        lines = ["%-15s %6s %6s %6s" % ("ms", "p50", "p95", "p99")]
+
+        for phase in ("total",) + PHASES:
+            lines.append("%-15s %6.2f %6.2f %6.2f" % (phase, *self.percentiles(phase)))
+
+        for counter in COUNTERS:
+            if counter in self.counters:
+                lines.append("%-15s %6d" % (counter, self.counters[counter]))
+
+        return lines
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+
+def cache_hit_percent(cache_info):
+    """Hit rate of a functools.lru_cache, from its cache_info()"""
+    lookups = cache_info.hits + cache_info.misses
+
+    return 100 * cache_info.hits / lookups if lookups else 0
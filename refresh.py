@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+
+import requests
+
+import network
+import network_file
+
+# Support for pull_data.py --incremental: remembering what every source looked like last time, so unchanged ones
+# can be skipped, and turning the difference between two pulls into journal entries (see saving.py).
+
+CACHE_DIR = "pull_cache"
+HTTP_TIMEOUT = 30 # Seconds
+
+class SourceCache:
+    """What every source (file or URL) looked like the last time it was pulled, along with the last network pulled from them.
+    Nothing is written until save() is called, so a failed pull leaves the cache as it was."""
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self.state_path = os.path.join(directory, "state.json")
+        self.pulled_path = os.path.join(directory, "pulled.json")
+
+        try:
+            with open(self.state_path, "r") as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {} # Path or URL -> what it looked like
+
+        self.changed = set() # Sources that changed since the last pull
+        self.bodies = {} # URL -> response body to store
+
+    def file_changed(self, path):
+        """Whether a file changed since the last pull. Only reads it if its size or modification time did"""
+        stat = os.stat(path)
+        entry = self.state.get(path, {})
+
+        if entry.get("mtime") == stat.st_mtime_ns and entry.get("size") == stat.st_size:
+            return False
+
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+
+        # Touched but not changed
+        changed = entry.get("sha256") != digest
+
+        self.state[path] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest}
+
+        if changed:
+            self.changed.add(path)
+
+        return changed
+
+    def fetch(self, url):
+        """Returns the body at url. Asks the server to only send it if it changed since the last pull"""
+        entry = self.state.get(url, {})
+        body_path = self._body_path(url)
+        headers = {}
+
+        if os.path.exists(body_path):
+            if "etag" in entry:
+                headers["If-None-Match"] = entry["etag"]
+
+            if "last_modified" in entry:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        r = requests.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+
+        if r.status_code == 304:
+            with open(body_path, "rb") as f:
+                return f.read()
+
+        r.raise_for_status()
+
+        digest = hashlib.sha256(r.content).hexdigest()
+
+        if entry.get("sha256") != digest:
+            self.changed.add(url)
+
+        self.state[url] = {"sha256": digest}
+
+        # Servers without ETags can still have Last-Modified, and the other way round
+        if "ETag" in r.headers:
+            self.state[url]["etag"] = r.headers["ETag"]
+
+        if "Last-Modified" in r.headers:
+            self.state[url]["last_modified"] = r.headers["Last-Modified"]
+
+        self.bodies[url] = r.content
+
+        return r.content
+
+    def always_changed(self, name):
+        """For sources that can't tell whether they changed"""
+        self.state[name] = {}
+        self.changed.add(name)
+
+    def keep_only(self, names):
+        """Forgets sources that aren't pulled from anymore, which counts as a change"""
+        for name in self.state.keys() - set(names):
+            del self.state[name]
+            self.changed.add(name)
+
+    def load_pulled(self):
+        """The network built by the last pull, or None"""
+        try:
+            return network_file.read_network(self.pulled_path)
+        except FileNotFoundError:
+            return None
+
+    def save(self, pulled=None):
+        """Remembers the sources as they were for this pull, and pulled as the network built from them (if anything was built)"""
+        os.makedirs(self.directory, exist_ok=True)
+
+        for url, body in self.bodies.items():
+            with open(self._body_path(url), "wb") as f:
+                f.write(body)
+
+        if pulled is not None:
+            network_file.write_network(pulled, self.pulled_path)
+
+        # Last, so the state never claims a body or network that isn't there
+        with open(self.state_path, "w") as f:
+            json.dump(self.state, f, indent=4)
+
+    def _body_path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".body")
+
+def diff_networks(old, new):
+    """What changed from one network to the other, as journal entries: removed lines, removed waypoints,
+    added and changed waypoints (moved or renamed, with the same ID), then added lines"""
+    old_waypoints = {w["id"]: w for w in old["waypoints"]}
+    new_waypoints = {w["id"]: w for w in new["waypoints"]}
+
+    old_lines = {(network.line_key(l["p1"], l["p2"]), l["type"]): l for l in old["lines"]}
+    new_lines = {(network.line_key(l["p1"], l["p2"]), l["type"]): l for l in new["lines"]}
+
+    entries = []
+
+    for key, l in old_lines.items():
+        if key not in new_lines:
+            entries.append({"op": "remove_line", "p1": l["p1"], "p2": l["p2"], "type": l["type"]})
+
+    for w_id in old_waypoints.keys() - new_waypoints.keys():
+        entries.append({"op": "remove_waypoint", "id": w_id})
+
+    for w_id, w in new_waypoints.items():
+        if old_waypoints.get(w_id) != w:
+            entries.append({"op": "add_waypoint", "waypoint": w})
+
+    for key, l in new_lines.items():
+        if key not in old_lines:
+            entries.append({"op": "add_line", "line": l})
+
+    return entries
+
+def summarize_diff(entries, old):
+    """Counts of what a diff from diff_networks does, for printing"""
+    old_ids = {w["id"] for w in old["waypoints"]}
+    counts = {"waypoints added": 0, "waypoints changed": 0, "waypoints removed": 0, "lines added": 0, "lines removed": 0}
+
+    for entry in entries:
+        if entry["op"] == "add_waypoint":
+            counts["waypoints changed" if entry["waypoint"]["id"] in old_ids else "waypoints added"] += 1
+        elif entry["op"] == "remove_waypoint":
+            counts["waypoints removed"] += 1
+        elif entry["op"] == "add_line":
+            counts["lines added"] += 1
+        else:
+            counts["lines removed"] += 1
+
+    return counts
@@ -0,0 +1,796 @@
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import heapq
+import math
+import os
+import random
+
+import numpy as np
+
+import network_file
+import saving
+
+ROUTE_CACHE_SIZE = 1024 # Routes remembered per graph
+
+# TRAVEL TIME CONSTANTS
+
+LINE_SPEEDS = {0: 8.0, 1: 4.3} # Blocks per second by line type, riding a line and walking
+TRANSFER_PENALTY = 30 # Seconds it takes to change between network types (AirCS, SQTR, ...)
+
+ALTERNATIVE_ROUTES = 3 # Routes search_alternative_routes looks for
+ALTERNATIVE_PENALTY = 1.4 # Cost multiplier for lines already used by a route, to push the next one elsewhere
+ALTERNATIVE_MAX_STRETCH = 1.5 # Alternatives costing more than this times the best route aren't worth showing
+PARALLEL_MIN_SOURCES = 64 # Cost matrices with fewer sources than this aren't worth starting processes for
+WITNESS_SETTLE_LIMIT = 64 # Waypoints a witness search may settle while building a contraction hierarchy
+
+class TravelTimeProfile:
+    """Prices lines by the seconds they take instead of their length. Slower line types and changing networks cost more"""
+
+    def __init__(self, line_speeds=LINE_SPEEDS, transfer_penalty=TRANSFER_PENALTY):
+        self.line_speeds = line_speeds
+        self.transfer_penalty = transfer_penalty
+
+        # Keeps the straight line heuristic from ever overestimating
+        self.heuristic_scale = 1 / max(line_speeds.values())
+
+    def cost(self, distance, line_type, transfer):
+        speed = self.line_speeds.get(line_type, min(self.line_speeds.values()))
+
+        return distance / speed + (self.transfer_penalty if transfer else 0)
+
+class RoutingGraph:
+    """Compact adjacency index over the waypoint network, used for pathfinding"""
+
+    def __init__(self, data, profile=None, columns=None):
+        # Waypoints are addressed by their position in these lists instead of by ID
+        if columns is not None:
+            # Straight from a network_file.NetworkFile of the same data, without building every waypoint
+            self.ids = columns.ids.tolist()
+            self.positions = list(zip(*columns.positions.T.tolist()))
+            self.types = columns.waypoint_types()
+        else:
+            self.ids = [w["id"] for w in data["waypoints"]]
+            self.positions = [tuple(w["pos"]) for w in data["waypoints"]]
+            self.types = [w["type"] for w in data["waypoints"]]
+
+        self.index = {w_id: i for i, w_id in enumerate(self.ids)}
+
+        # Costs are plain distances without a profile
+        self.profile = profile
+        self.heuristic_scale = profile.heuristic_scale if profile is not None else 1
+
+        # neighbours[i] is a list of (neighbour index, distance) pairs
+        self.neighbours = [[] for _ in self.ids]
+
+        if columns is not None:
+            # The lines are already waypoint indexes there
+            self._link_all(zip(*columns.line_ends.T.tolist(), columns.line_types.tolist()))
+        else:
+            index = self.index
+            self._link_all((index.get(l["p1"], -1), index.get(l["p2"], -1), l.get("type")) for l in data["lines"])
+
+        # (start ID, end ID) -> path, see find_route. Edits only drop the routes they could change.
+        self.routes = collections.OrderedDict()
+
+        # ContractionHierarchy matching this graph, if one was built or loaded. Makes find_route use find_path_ch.
+        # Dropped by any edit, it can't be updated in place.
+        self.hierarchy = None
+
+        self._fingerprint = None
+
+    def line_ends(self, line):
+        """Returns (index, index, cost) of a line, or None if it can't be used"""
+        i = self.index.get(line["p1"])
+        j = self.index.get(line["p2"])
+
+        # Skip lines pointing at waypoints we don't know about, and lines to self
+        if i is None or j is None or i == j:
+            return None
+
+        cost = math.dist(self.positions[i], self.positions[j])
+
+        if self.profile is not None:
+            cost = self.profile.cost(cost, line.get("type"), self.types[i] != self.types[j])
+
+        return i, j, cost
+
+    def _link_all(self, lines):
+        """Same as _link for an iterable of (index, index, line type), -1 being a missing waypoint. Much faster for big networks"""
+        positions = self.positions
+        neighbours = self.neighbours
+
+        for i, j, line_type in lines:
+            if i < 0 or j < 0 or i == j:
+                continue
+
+            cost = math.dist(positions[i], positions[j])
+
+            if self.profile is not None:
+                cost = self.profile.cost(cost, line_type, self.types[i] != self.types[j])
+
+            neighbours[i].append((j, cost))
+            neighbours[j].append((i, cost))
+
+    def _link(self, line):
+        ends = self.line_ends(line)
+
+        if ends is None:
+            return None
+
+        i, j, cost = ends
+
+        self.neighbours[i].append((j, cost))
+        self.neighbours[j].append((i, cost))
+
+        return ends
+
+    def _edited(self, keep_route):
+        """Forgets whatever an edit made stale. keep_route(path) says whether a remembered path (or None) is still the best"""
+        self.hierarchy = None
+        self._fingerprint = None
+
+        for key, routes in list(self.routes.items()):
+            # find_route keeps a path, cache_alternative_routes a list of (cost, path), where empty means no route
+            paths = [routes] if len(key) == 2 else [path for _, path in routes] or [None]
+
+            if not all(keep_route(path) for path in paths):
+                del self.routes[key]
+
+    # EDITING, every edit is O(number of lines at the waypoints involved + remembered routes)
+
+    def add_line(self, line):
+        ends = self._link(line)
+
+        if ends is not None:
+            self._edited(lambda path: not line_may_shorten(self, path, *ends))
+
+    def remove_line(self, line):
+        ends = self.line_ends(line)
+
+        if ends is None:
+            return
+
+        i, j, cost = ends
+
+        self.neighbours[i].remove((j, cost))
+        self.neighbours[j].remove((i, cost))
+
+        # Routes along another line between the same waypoints that's as cheap stay as good as they were
+        if any(child == j and other_cost <= cost for child, other_cost in self.neighbours[i]):
+            self._edited(lambda path: True)
+        else:
+            self._edited(lambda path: not path_uses_line(path, line["p1"], line["p2"]))
+
+    def add_waypoint(self, waypoint):
+        self.index[waypoint["id"]] = len(self.ids)
+        self.ids.append(waypoint["id"])
+        self.positions.append(tuple(waypoint["pos"]))
+        self.types.append(waypoint["type"])
+        self.neighbours.append([])
+
+        # A waypoint without lines doesn't change any route
+        self._edited(lambda path: True)
+
+    def remove_waypoint(self, w_id):
+        """Removes a waypoint and its lines. Its index is left empty, so no other waypoint has to move"""
+        i = self.index.pop(w_id)
+
+        for j, cost in self.neighbours[i]:
+            self.neighbours[j].remove((i, cost))
+
+        self.neighbours[i] = []
+        self.ids[i] = None
+
+        self._edited(lambda path: path is None or w_id not in path)
+
+    def live_ids(self):
+        """IDs of the waypoints that weren't removed"""
+        return [w_id for w_id in self.ids if w_id is not None]
+
+    def line_cost(self, i, j):
+        """Cost of the cheapest line between two waypoint indexes"""
+        return min(cost for child, cost in self.neighbours[i] if child == j)
+
+    def fingerprint(self):
+        """Hash of the waypoints and lines, to tell whether saved results still belong to this graph"""
+        if self._fingerprint is None:
+            edges = sorted(
+                (self.ids[i], self.ids[j], round(cost, 3))
+                for i, neighbours in enumerate(self.neighbours)
+                for j, cost in neighbours
+                if i < j
+            )
+
+            self._fingerprint = hashlib.sha1(repr((self.live_ids(), edges)).encode()).hexdigest()
+
+        return self._fingerprint
+
+    def __getstate__(self):
+        # Worker processes only need the graph itself, not the routes found so far
+        state = self.__dict__.copy()
+        state["routes"] = collections.OrderedDict()
+        return state
+
+def find_path_a_star(graph, start_waypoint_id, end_waypoint_id, stats=None):
+    start = graph.index.get(start_waypoint_id)
+    end = graph.index.get(end_waypoint_id)
+
+    if start is None or end is None:
+        return None
+
+    path = _a_star(graph, start, end, stats=stats)
+
+    return [graph.ids[i] for i in path] if path is not None else None
+
+def _a_star(graph, start, end, penalties=None, stats=None, cancel=None):
+    """A* between waypoint indexes, returns a list of indexes or None. penalties maps (i, j) to a multiplier of that line's cost.
+    Gives up (returning None) as soon as cancel, a threading.Event, is set"""
+    positions = graph.positions
+    neighbours = graph.neighbours
+    end_pos = positions[end]
+    scale = graph.heuristic_scale
+
+    # Best known distance from the start, and where we came from
+    g = {start: 0.0}
+    parents = {start: None}
+    closed = set()
+
+    # The open set is a heap of (f, g, node index)
+    open_heap = [(math.dist(positions[start], end_pos) * scale, 0.0, start)]
+
+    while open_heap:
+        _, current_g, current = heapq.heappop(open_heap)
+
+        # Stale heap entry, we've already settled this node through a shorter path
+        if current in closed:
+            continue
+
+        if cancel is not None and cancel.is_set():
+            return None
+
+        # Have we found the goal yet?
+        if current == end:
+            # We have! Let's backtrack.
+            path = []
+
+            while current is not None:
+                path.append(current)
+                current = parents[current]
+
+            if stats is not None:
+                stats["settled"] = len(closed)
+
+            return path[::-1]
+
+        closed.add(current)
+
+        for child, cost in neighbours[current]:
+            if child in closed:
+                continue
+
+            if penalties is not None:
+                cost *= penalties.get((current, child), 1)
+
+            child_g = current_g + cost
+
+            if child_g >= g.get(child, math.inf):
+                continue
+
+            g[child] = child_g
+            parents[child] = current
+
+            heapq.heappush(open_heap, (child_g + math.dist(positions[child], end_pos) * scale, child_g, child))
+
+    if stats is not None:
+        stats["settled"] = len(closed)
+
+    return None
+
+def find_route(graph, start_waypoint_id, end_waypoint_id):
+    """Same as find_path_a_star, but remembers the routes it found until the graph is rebuilt"""
+    key = (start_waypoint_id, end_waypoint_id)
+
+    if key in graph.routes:
+        graph.routes.move_to_end(key)
+        path = graph.routes[key]
+    elif (end_waypoint_id, start_waypoint_id) in graph.routes:
+        # Lines go both ways, so the way back is the same route
+        path = graph.routes[(end_waypoint_id, start_waypoint_id)]
+        path = path[::-1] if path is not None else None
+    else:
+        if graph.hierarchy is not None:
+            path = find_path_ch(graph, graph.hierarchy, start_waypoint_id, end_waypoint_id)
+        else:
+            path = find_path_a_star(graph, start_waypoint_id, end_waypoint_id)
+
+        graph.routes[key] = path
+
+        if len(graph.routes) > ROUTE_CACHE_SIZE:
+            graph.routes.popitem(last=False)
+
+    return list(path) if path is not None else None
+
+def dijkstra(graph, source):
+    """Returns the travel cost from the waypoint at index source to every waypoint, by index"""
+    costs = [math.inf] * len(graph.ids)
+    costs[source] = 0.0
+
+    heap = [(0.0, source)]
+
+    while heap:
+        cost, current = heapq.heappop(heap)
+
+        if cost > costs[current]:
+            continue
+
+        for child, line_cost in graph.neighbours[current]:
+            child_cost = cost + line_cost
+
+            if child_cost < costs[child]:
+                costs[child] = child_cost
+                heapq.heappush(heap, (child_cost, child))
+
+    return costs
+
+def path_uses_line(path, w1_id, w2_id):
+    """Whether a path of waypoint IDs (or None) goes along the line between two waypoints, either way"""
+    return path is not None and any((a == w1_id and b == w2_id) or (a == w2_id and b == w1_id) for a, b in zip(path, path[1:]))
+
+def line_may_shorten(graph, path, i, j, cost):
+    """Whether a new line between waypoint indexes i and j could make a cheaper route between the ends of a path. None paths can be connected by anything"""
+    if path is None:
+        return True
+
+    start = graph.positions[graph.index[path[0]]]
+    end = graph.positions[graph.index[path[-1]]]
+
+    # The shortest way to use the new line still has to get to it and away from it, which costs at least the straight line
+    bound = cost + graph.heuristic_scale * min(
+        math.dist(start, graph.positions[i]) + math.dist(graph.positions[j], end),
+        math.dist(start, graph.positions[j]) + math.dist(graph.positions[i], end)
+    )
+
+    return bound < path_cost(graph, path)
+
+def path_cost(graph, path):
+    """Total cost of a path of waypoint IDs"""
+    return sum(graph.line_cost(graph.index[a], graph.index[b]) for a, b in zip(path, path[1:]))
+
+def cached_alternative_routes(graph, start_waypoint_id, end_waypoint_id, count=ALTERNATIVE_ROUTES):
+    """What cache_alternative_routes remembered, or None"""
+    key = (start_waypoint_id, end_waypoint_id, count)
+
+    if key not in graph.routes:
+        return None
+
+    graph.routes.move_to_end(key)
+    return [(cost, list(path)) for cost, path in graph.routes[key]]
+
+def cache_alternative_routes(graph, start_waypoint_id, end_waypoint_id, routes, count=ALTERNATIVE_ROUTES):
+    """Remembers routes from search_alternative_routes, which have to be for the graph as it is now"""
+    graph.routes[(start_waypoint_id, end_waypoint_id, count)] = [(cost, list(path)) for cost, path in routes]
+
+    if len(graph.routes) > ROUTE_CACHE_SIZE:
+        graph.routes.popitem(last=False)
+
+def search_alternative_routes(graph, start_waypoint_id, end_waypoint_id, count=ALTERNATIVE_ROUTES, cancel=None):
+    """Returns up to count different (cost, path) routes, cheapest first. Doesn't touch graph.routes, so it can run on another thread,
+    as long as cancel (a threading.Event) is set before the graph is edited. A cancelled search returns whatever it found so far.
+    Every route found makes its lines more expensive for the next search, which is much faster than finding the exact next best routes."""
+    start = graph.index.get(start_waypoint_id)
+    end = graph.index.get(end_waypoint_id)
+    hierarchy = graph.hierarchy
+    routes = []
+
+    if start is not None and end is not None:
+        penalties = {}
+        seen = set()
+
+        # A few more searches than routes wanted, as some come back with a route we already have
+        for _ in range(count * 2):
+            # The first route is the plain shortest one, which the hierarchy finds much faster
+            if not seen and hierarchy is not None:
+                path = find_path_ch(graph, hierarchy, start_waypoint_id, end_waypoint_id)
+                path = [graph.index[w_id] for w_id in path] if path is not None else None
+            else:
+                path = _a_star(graph, start, end, penalties, cancel=cancel)
+
+            if path is None:
+                break
+
+            for i, j in zip(path, path[1:]):
+                penalties[(i, j)] = penalties[(j, i)] = penalties.get((i, j), 1) * ALTERNATIVE_PENALTY
+
+            if tuple(path) in seen:
+                continue
+
+            seen.add(tuple(path))
+
+            cost = sum(graph.line_cost(i, j) for i, j in zip(path, path[1:]))
+
+            if routes and cost > routes[0][0] * ALTERNATIVE_MAX_STRETCH:
+                continue
+
+            routes.append((cost, [graph.ids[i] for i in path]))
+
+            if len(routes) == count:
+                break
+
+    routes.sort(key=lambda route: route[0])
+
+    return routes
+
+# CONTRACTION HIERARCHY
+
+class ContractionHierarchy:
+    """The network with waypoints ranked by importance and shortcuts added around the less important ones.
+    A route only ever has to go up in rank from both ends, so searches stay small."""
+
+    def __init__(self, ranks, up, middles, fingerprint):
+        self.ranks = ranks # Waypoint index -> rank, 0 was contracted first
+        self.up = up # up[i] is a list of (higher ranked waypoint index, cost) pairs
+        self.middles = middles # (i, j) -> waypoint index the shortcut between i and j skips over, both ways round
+        self.fingerprint = fingerprint
+
+    def save(self, path):
+        sizes = [len(edges) for edges in self.up]
+        middles = np.array([(i, j, m) for (i, j), m in self.middles.items() if i < j], dtype=np.int64).reshape(-1, 3)
+
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                ranks=np.array(self.ranks, dtype=np.int64),
+                up_offsets=np.cumsum([0] + sizes),
+                up_targets=np.array([j for edges in self.up for j, _ in edges], dtype=np.int64),
+                up_costs=np.array([cost for edges in self.up for _, cost in edges], dtype=np.float64),
+                middles=middles,
+                fingerprint=np.array(self.fingerprint)
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            offsets = f["up_offsets"].tolist()
+            targets = f["up_targets"].tolist()
+            costs = f["up_costs"].tolist()
+
+            up = [list(zip(targets[offsets[i]:offsets[i + 1]], costs[offsets[i]:offsets[i + 1]])) for i in range(len(offsets) - 1)]
+            middles = {}
+
+            for i, j, m in f["middles"].tolist():
+                middles[(i, j)] = middles[(j, i)] = m
+
+            return cls(f["ranks"].tolist(), up, middles, str(f["fingerprint"]))
+
+def hierarchy_path(waypoints_path):
+    """Where the contraction hierarchy of a waypoints file is kept"""
+    return os.path.splitext(waypoints_path)[0] + ".hierarchy.npz"
+
+def build_contraction_hierarchy(graph):
+    """Contracts waypoints one by one, least important first, adding a shortcut wherever that removes the only shortest path between two neighbours"""
+    n = len(graph.ids)
+
+    # What's left of the network, i -> {j: cost}, cheapest line only
+    remaining = [{} for _ in range(n)]
+
+    for i, neighbours in enumerate(graph.neighbours):
+        for j, cost in neighbours:
+            if cost < remaining[i].get(j, math.inf):
+                remaining[i][j] = cost
+
+    ranks = [0] * n
+    up = [[] for _ in range(n)]
+    middles = {}
+    contracted_neighbours = [0] * n
+    levels = [0] * n # How many contractions deep a waypoint is
+
+    def witness_costs(source, skipped, limit, targets):
+        # Small Dijkstra around source that avoids the waypoint being contracted. Gives up early, which only costs an unneeded shortcut.
+        costs = {source: 0.0}
+        heap = [(0.0, source)]
+        targets = set(targets)
+        settled = 0
+
+        while heap and targets and settled < WITNESS_SETTLE_LIMIT:
+            cost, current = heapq.heappop(heap)
+
+            if cost > costs[current]:
+                continue
+
+            if cost > limit:
+                break
+
+            settled += 1
+            targets.discard(current)
+
+            for child, line_cost in remaining[current].items():
+                child_cost = cost + line_cost
+
+                if child != skipped and child_cost < costs.get(child, math.inf):
+                    costs[child] = child_cost
+                    heapq.heappush(heap, (child_cost, child))
+
+        return costs
+
+    def find_shortcuts(v):
+        neighbours = list(remaining[v].items())
+        shortcuts = []
+
+        for a, (u, u_cost) in enumerate(neighbours[:-1]):
+            others = neighbours[a + 1:]
+            costs = witness_costs(u, v, u_cost + max(cost for _, cost in others), [w for w, _ in others])
+
+            for w, w_cost in others:
+                if costs.get(w, math.inf) > u_cost + w_cost:
+                    shortcuts.append((u, w, u_cost + w_cost))
+
+        return shortcuts
+
+    def priority(v, shortcuts):
+        # Edge difference, plus nudges to spread contraction out evenly over the map and keep the hierarchy shallow
+        return 2 * (len(shortcuts) - len(remaining[v])) + contracted_neighbours[v] + levels[v]
+
+    priorities = [priority(v, find_shortcuts(v)) for v in range(n)]
+    heap = [(p, v) for v, p in enumerate(priorities)]
+    heapq.heapify(heap)
+
+    contracted = [False] * n
+    rank = 0
+
+    while heap:
+        p, v = heapq.heappop(heap)
+
+        if contracted[v] or p != priorities[v]:
+            continue
+
+        # Priorities go stale as the network around a waypoint changes, so check again before committing to it
+        shortcuts = find_shortcuts(v)
+        priorities[v] = priority(v, shortcuts)
+
+        if heap and priorities[v] > heap[0][0]:
+            heapq.heappush(heap, (priorities[v], v))
+            continue
+
+        for u, w, cost in shortcuts:
+            if cost < remaining[u].get(w, math.inf):
+                remaining[u][w] = cost
+                remaining[w][u] = cost
+                middles[(u, w)] = middles[(w, u)] = v
+
+        for u, cost in remaining[v].items():
+            up[v].append((u, cost))
+            del remaining[u][v]
+            contracted_neighbours[u] += 1
+            levels[u] = max(levels[u], levels[v] + 1)
+
+        remaining[v] = {}
+        contracted[v] = True
+        ranks[v] = rank
+        rank += 1
+
+    return ContractionHierarchy(ranks, up, middles, graph.fingerprint())
+
+def find_path_ch(graph, hierarchy, start_waypoint_id, end_waypoint_id, stats=None):
+    """Same result as find_path_a_star. Searches upwards from both ends at once, and unpacks the shortcuts of where they meet"""
+    start = graph.index.get(start_waypoint_id)
+    end = graph.index.get(end_waypoint_id)
+
+    if start is None or end is None:
+        return None
+
+    up = hierarchy.up
+
+    # Forward search from the start, backward search from the end
+    costs = ({start: 0.0}, {end: 0.0})
+    parents = ({start: None}, {end: None})
+    heaps = ([(0.0, start)], [(0.0, end)])
+    settled = 0
+
+    # Cost of the best path found so far, and where its two halves meet
+    best = math.inf
+    meeting = None
+
+    while heaps[0] or heaps[1]:
+        side = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+        cost, current = heapq.heappop(heaps[side])
+
+        if cost > costs[side][current]:
+            continue
+
+        # Everything else on this side is at least as expensive as the best path
+        if cost >= best:
+            heaps[side].clear()
+            continue
+
+        other_cost = costs[1 - side].get(current)
+
+        if other_cost is not None and cost + other_cost < best:
+            best = cost + other_cost
+            meeting = current
+
+        # Stall on demand: if a higher ranked neighbour already reaches this waypoint cheaper, the route can't go up through it
+        if any(costs[side].get(child, math.inf) + line_cost < cost for child, line_cost in up[current]):
+            continue
+
+        settled += 1
+
+        for child, line_cost in up[current]:
+            child_cost = cost + line_cost
+
+            if child_cost < costs[side].get(child, math.inf):
+                costs[side][child] = child_cost
+                parents[side][child] = current
+                heapq.heappush(heaps[side], (child_cost, child))
+
+    if stats is not None:
+        stats["settled"] = settled
+
+    if meeting is None:
+        return None
+
+    # Backtrack to the start, then follow the backward search to the end
+    hops = []
+    current = meeting
+
+    while current is not None:
+        hops.append(current)
+        current = parents[0][current]
+
+    hops.reverse()
+    current = parents[1][meeting]
+
+    while current is not None:
+        hops.append(current)
+        current = parents[1][current]
+
+    # Replace every shortcut with the two lines it skips over, until there are none left
+    path = [hops[0]]
+    stack = [(a, b) for a, b in zip(hops[::-1][1:], hops[::-1])]
+
+    while stack:
+        a, b = stack.pop()
+        middle = hierarchy.middles.get((a, b))
+
+        if middle is None:
+            path.append(b)
+        else:
+            stack.append((middle, b))
+            stack.append((a, middle))
+
+    return [graph.ids[i] for i in path]
+
+def check_hierarchy(graph, hierarchy, pair_count=100, seed=0):
+    """Compares find_path_ch against find_path_a_star on random pairs. Returns (start ID, end ID, expected cost, cost) where they differ"""
+    rng = random.Random(seed)
+    mismatches = []
+
+    for _ in range(pair_count if len(graph.ids) > 1 else 0):
+        start_id, end_id = rng.sample(graph.ids, 2)
+
+        expected = find_path_a_star(graph, start_id, end_id)
+        path = find_path_ch(graph, hierarchy, start_id, end_id)
+
+        expected_cost = path_cost(graph, expected) if expected is not None else None
+        cost = path_cost(graph, path) if path is not None else None
+
+        if (cost is None) != (expected_cost is None) or (cost is not None and not math.isclose(cost, expected_cost, rel_tol=1e-9, abs_tol=1e-6)):
+            mismatches.append((start_id, end_id, expected_cost, cost))
+
+    return mismatches
+
+# COST MATRIX
+
+class CostMatrix:
+    """Travel costs from a set of source waypoints to a set of target waypoints"""
+
+    def __init__(self, source_ids, target_ids, costs, fingerprint):
+        self.source_ids = list(source_ids)
+        self.target_ids = list(target_ids)
+        self.costs = costs # numpy array, costs[source index, target index]. Unreachable is inf.
+        self.fingerprint = fingerprint
+
+        self.source_index = {w_id: i for i, w_id in enumerate(self.source_ids)}
+        self.target_index = {w_id: i for i, w_id in enumerate(self.target_ids)}
+
+    def cost(self, source_id, target_id):
+        return float(self.costs[self.source_index[source_id], self.target_index[target_id]])
+
+    def nearest(self, source_id, target_ids):
+        """Returns (target ID, cost) of the cheapest reachable target, or None"""
+        target_ids = [w_id for w_id in target_ids if w_id in self.target_index and w_id != source_id]
+
+        if source_id not in self.source_index or not target_ids:
+            return None
+
+        costs = self.costs[self.source_index[source_id], [self.target_index[w_id] for w_id in target_ids]]
+        best = int(np.argmin(costs))
+
+        if math.isinf(costs[best]):
+            return None
+
+        return target_ids[best], float(costs[best])
+
+    def tour_cost(self, stop_ids):
+        """Total cost of visiting the stops in order"""
+        return sum(self.cost(a, b) for a, b in zip(stop_ids, stop_ids[1:]))
+
+    def save(self, path):
+        # Through a file object, so numpy doesn't add its own extension to the name
+        with open(path, "wb") as f:
+            np.savez(f, source_ids=np.array(self.source_ids, dtype=np.int64), target_ids=np.array(self.target_ids, dtype=np.int64), costs=self.costs, fingerprint=np.array(self.fingerprint))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f["source_ids"].tolist(), f["target_ids"].tolist(), f["costs"], str(f["fingerprint"]))
+
+def cost_matrix_path(waypoints_path):
+    """Where the cost matrix of a waypoints file is kept"""
+    return os.path.splitext(waypoints_path)[0] + ".costs.npz"
+
+# Set in each worker process by _init_worker, so the graph is only sent over once per process
+_worker_graph = None
+
+def _init_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+def _worker_costs(task):
+    source, targets = task
+    costs = dijkstra(_worker_graph, source)
+
+    return [costs[target] for target in targets]
+
+def compute_cost_matrix(graph, source_ids=None, target_ids=None, processes=None):
+    """Runs one Dijkstra per source, across processes if there are enough sources. Defaults to all waypoints"""
+    source_ids = graph.live_ids() if source_ids is None else source_ids
+    target_ids = graph.live_ids() if target_ids is None else target_ids
+
+    targets = [graph.index[w_id] for w_id in target_ids]
+    tasks = [(graph.index[w_id], targets) for w_id in source_ids]
+
+    if processes == 1 or len(tasks) < PARALLEL_MIN_SOURCES:
+        _init_worker(graph)
+        rows = list(map(_worker_costs, tasks))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(graph,)) as executor:
+            rows = list(executor.map(_worker_costs, tasks, chunksize=max(1, len(tasks) // ((processes or os.cpu_count() or 1) * 4))))
+
+    costs = np.array(rows, dtype=np.float64).reshape(len(source_ids), len(target_ids))
+
+    return CostMatrix(source_ids, target_ids, costs, graph.fingerprint())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute routing data for a waypoints file")
+    parser.add_argument("path", nargs="?", default="waypoints.json")
+    parser.add_argument("--hierarchy", action="store_true", help="build a contraction hierarchy for faster routing instead of the cost matrix")
+    parser.add_argument("--check", type=int, default=0, metavar="PAIRS", help="with --hierarchy, compare its routes against plain A* on this many random pairs")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes for the cost matrix, defaults to one per core")
+    args = parser.parse_args()
+
+    # With the journal replayed, the fingerprint is the one display.py checks against
+    data = network_file.read_network(args.path)
+    saving.replay_journal(data, args.path)
+
+    graph = RoutingGraph(data)
+
+    if args.hierarchy:
+        hierarchy = build_contraction_hierarchy(graph)
+        hierarchy.save(hierarchy_path(args.path))
+
+        print("Saved a hierarchy with %d shortcuts to %s" % (len(hierarchy.middles) // 2, hierarchy_path(args.path)))
+
+        if args.check:
+            mismatches = check_hierarchy(graph, hierarchy, args.check)
+
+            for start_id, end_id, expected_cost, cost in mismatches:
+                print("Mismatch %d -> %d: expected %s, got %s" % (start_id, end_id, expected_cost, cost))
+
+            print("%d of %d pairs differ" % (len(mismatches), args.check))
+    else:
+        matrix = compute_cost_matrix(graph, processes=args.processes)
+        matrix.save(cost_matrix_path(args.path))
+
+        print("Saved %dx%d costs to %s" % (len(matrix.source_ids), len(matrix.target_ids), cost_matrix_path(args.path)))
@@ -0,0 +1,185 @@
+import json
+import os
+import queue
+import threading
+
+import network
+import network_file
+
+# Edits are appended to a journal next to the network file as they're made, one JSON object per line, and the
+# network file itself is only written again (compacted) now and then. Loading replays the journal on top of it.
+#
+# Journal entries:
+#   {"op": "add_waypoint", "waypoint": {...}}
+#   {"op": "remove_waypoint", "id": ...}
+#   {"op": "add_line", "line": {...}}
+#   {"op": "remove_line", "p1": ..., "p2": ..., "type": ...}
+#
+# Replaying an entry twice does nothing the second time, so a crash between writing the network file and
+# emptying the journal is harmless.
+
+AUTOSAVE_INTERVAL = 10 # Seconds between appending edits to the journal
+JOURNAL_COMPACT_EDITS = 1000 # Write the whole network again once the journal has this many entries
+
+def journal_path(path):
+    return os.path.splitext(path)[0] + ".journal"
+
+def replay_journal(data, path):
+    """Applies the journal of the network file at path to data. Returns how many entries there were"""
+    try:
+        f = open(journal_path(path), "r")
+    except FileNotFoundError:
+        return 0
+
+    with f:
+        return apply_entries(data, _read_entries(f))
+
+def _read_entries(f):
+    for line in f:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Cut short by a crash while it was appended
+            continue
+
+def apply_entries(data, entries):
+    """Applies journal entries to data. Returns how many there were"""
+    index = network.NetworkIndex(data)
+    count = 0
+
+    for entry in entries:
+        _apply_entry(index, entry)
+        count += 1
+
+    return count
+
+def _apply_entry(index, entry):
+    op = entry["op"]
+
+    if op == "add_waypoint":
+        w = entry["waypoint"]
+        old = index.waypoints.get(w["id"])
+
+        if old is not None:
+            index.replace_waypoint(old, w)
+        else:
+            index.add_waypoint(w)
+
+    elif op == "remove_waypoint":
+        w = index.waypoints.get(entry["id"])
+
+        if w is not None:
+            for l in index.find_lines_of(w["id"]):
+                index.remove_line(l)
+
+            index.remove_waypoint(w)
+
+    elif op == "add_line":
+        l = entry["line"]
+
+        # Lines of different types can join the same waypoints
+        if index.find_line(l["p1"], l["p2"], l["type"]) is None:
+            index.add_line(l)
+
+    elif op == "remove_line":
+        # Older entries have no type, and remove the first line
+        l = index.find_line(entry["p1"], entry["p2"], entry.get("type"))
+
+        if l is not None:
+            index.remove_line(l)
+
+    else:
+        raise ValueError(f"Unknown journal entry {op!r}")
+
+class BackgroundSaver:
+    """Writes the journal and the network file on its own thread, so the render loop never waits for the disk.
+    Everything is written in the order it was asked for."""
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+
+        self.journal = None # Opened when first appended to
+        self.journal_entries = 0 # Entries in the journal once everything queued is written
+        self.compactions = 0 # Compactions asked for, so ones that a newer one makes pointless can be skipped
+
+        self.error = None # Last error, read by the UI. Cleared by the next successful write.
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def busy(self):
+        return self.queue.unfinished_tasks > 0
+
+    def append(self, entries):
+        """Appends journal entries"""
+        if not entries:
+            return
+
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        self.journal_entries += len(entries)
+        self.queue.put(lambda: self._append(lines))
+
+    def compact(self, snapshot):
+        """Writes snapshot as the network file and empties the journal. snapshot mustn't be changed afterwards"""
+        self.compactions += 1
+        self.journal_entries = 0
+
+        compaction = self.compactions
+        self.queue.put(lambda: self._compact(snapshot, compaction))
+
+    def wait(self):
+        """Blocks until everything asked for so far is written"""
+        self.queue.join()
+
+    def close(self):
+        self.wait()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+
+            try:
+                if task is None:
+                    if self.journal is not None:
+                        self.journal.close()
+
+                    return
+
+                task()
+                self.error = None
+            except OSError as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _append(self, lines):
+        if self.journal is None:
+            self.journal = open(journal_path(self.path), "a")
+
+            # Don't carry on from a line that was cut short
+            if self.journal.tell() > 0:
+                with open(journal_path(self.path), "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+
+                    if f.read(1) != b"\n":
+                        self.journal.write("\n")
+
+        self.journal.write(lines)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def _compact(self, snapshot, compaction):
+        # A newer snapshot is queued, which has every edit this one has
+        if compaction != self.compactions:
+            return
+
+        network_file.write_network(snapshot, self.path)
+
+        if self.journal is not None:
+            self.journal.close()
+
+        self.journal = open(journal_path(self.path), "w")
@@ -0,0 +1,157 @@
+import bisect
+import collections
+import heapq
+
+# Finding waypoints by name as it's typed. Prefixes (of the name, "type - name" or any word of the name) are looked up
+# in a sorted list, typos are caught by counting the trigrams (runs of three characters) a name shares with the query.
+# Neither looks at every waypoint.
+
+RESULT_COUNT = 8
+PREFIX_MATCHES_MAX = 256 # Prefix matches ranked per query, the rest are left out (only happens for very short queries)
+TRIGRAM_POSTINGS_MAX = 2048 # Trigrams in more names than this say too little to be worth counting, like "  s"
+TRIGRAM_SIMILARITY_MIN = 0.5 # Names with less of the query's trigrams than this aren't shown unless they match a prefix
+TRIGRAM_QUERY_MIN = 3 # Shorter queries only match prefixes, they have too few trigrams to tell names apart
+
+def _normalize(text):
+    # "Type - Name" and "type name" are the same
+    return " ".join(word for word in text.lower().split() if word != "-")
+
+def _trigrams(text):
+    """Trigrams of every word, padded so the start of a word counts for more"""
+    return {padded[i:i + 3] for padded in [f"  {word} " for word in text.split()] for i in range(len(padded) - 2)}
+
+def _prefix_keys(name, text):
+    return {name, text, *name.split()}
+
+class NameIndex:
+    """Waypoints by name and type. Kept up to date with add_waypoint and remove_waypoint instead of being rebuilt"""
+
+    def __init__(self, waypoints):
+        self.texts = {} # Waypoint ID -> normalized "type name"
+        self.names = {} # Waypoint ID -> normalized name
+
+        self.prefixes = [] # Sorted (key, waypoint ID)
+        self.trigrams = collections.defaultdict(set) # Trigram of a name -> IDs of the waypoints that have it
+
+        entries = []
+
+        for w in waypoints:
+            entries.extend(self._index(w))
+
+        self.prefixes = sorted(entries)
+
+    def _index(self, w):
+        """Indexes everything but the prefixes, which are returned"""
+        w_id = w["id"]
+        name = _normalize(w["name"])
+        text = f"{_normalize(w['type'])} {name}"
+
+        self.names[w_id] = name
+        self.texts[w_id] = text
+
+        trigrams = self.trigrams
+
+        for trigram in _trigrams(name):
+            trigrams[trigram].add(w_id)
+
+        return [(key, w_id) for key in _prefix_keys(name, text)]
+
+    def add_waypoint(self, w):
+        for entry in self._index(w):
+            bisect.insort(self.prefixes, entry)
+
+    def remove_waypoint(self, w_id):
+        text = self.texts.pop(w_id)
+        name = self.names.pop(w_id)
+
+        for trigram in _trigrams(name):
+            self.trigrams[trigram].discard(w_id)
+
+        for key in _prefix_keys(name, text):
+            i = bisect.bisect_left(self.prefixes, (key, w_id))
+            del self.prefixes[i]
+
+    def prefix_matches(self, query):
+        """IDs of the waypoints with a key starting with query, at most PREFIX_MATCHES_MAX"""
+        matches = set()
+        i = bisect.bisect_left(self.prefixes, (query,))
+
+        while i < len(self.prefixes) and self.prefixes[i][0].startswith(query) and len(matches) < PREFIX_MATCHES_MAX:
+            matches.add(self.prefixes[i][1])
+            i += 1
+
+        return matches
+
+class Search:
+    """A search being typed. Every change to the query only looks up the trigrams that changed"""
+
+    def __init__(self, index):
+        self.index = index
+        self.query = ""
+
+        self.query_trigrams = set()
+        self.shared = {} # Waypoint ID -> trigrams it shares with the query, only ones with at least one
+
+    def update(self, query):
+        """Changes the query. Returns the best matches as a list of waypoint IDs, best first"""
+        query = _normalize(query)
+
+        old_trigrams = self.query_trigrams
+        self.query_trigrams = {trigram for trigram in _trigrams(query) if len(self.index.trigrams.get(trigram, ())) <= TRIGRAM_POSTINGS_MAX}
+        self.query = query
+
+        for trigram, change in [(trigram, -1) for trigram in old_trigrams - self.query_trigrams] + [(trigram, 1) for trigram in self.query_trigrams - old_trigrams]:
+            for w_id in self.index.trigrams.get(trigram, ()):
+                count = self.shared.get(w_id, 0) + change
+
+                if count > 0:
+                    self.shared[w_id] = count
+                else:
+                    self.shared.pop(w_id, None)
+
+        return self.results()
+
+    def results(self):
+        if not self.query:
+            return []
+
+        prefix_matches = self.index.prefix_matches(self.query)
+        texts = self.index.texts
+
+        # Best first, then shortest, then alphabetically
+        return heapq.nsmallest(RESULT_COUNT, prefix_matches | self._similar(), key=lambda w_id: (-self._score(w_id, w_id in prefix_matches), len(texts[w_id]), texts[w_id]))
+
+    def _similar(self):
+        """The waypoints sharing the most trigrams with the query, at most RESULT_COUNT"""
+        if len(self.query) < TRIGRAM_QUERY_MIN:
+            return set()
+
+        texts = self.index.texts
+        shared_min = TRIGRAM_SIMILARITY_MIN * len(self.query_trigrams)
+
+        # Waypoints removed since the search started can still be counted here
+        similar = [w_id for w_id, shared in self.shared.items() if shared >= shared_min and w_id in texts]
+
+        return set(heapq.nsmallest(RESULT_COUNT, similar, key=lambda w_id: (-self.shared[w_id], len(texts[w_id]), texts[w_id])))
+
+    def _similarity(self, w_id):
+        """How many of the query's (useful) trigrams the waypoint has, from 0 to 1"""
+        # Waypoints removed since the search started can still be counted here
+        if w_id not in self.index.texts:
+            return 0
+
+        return self.shared.get(w_id, 0) / len(self.query_trigrams) if self.query_trigrams else 0
+
+    def _score(self, w_id, prefix_match):
+        name = self.index.names[w_id]
+
+        if name == self.query or self.index.texts[w_id] == self.query:
+            rank = 3
+        elif name.startswith(self.query) or self.index.texts[w_id].startswith(self.query):
+            rank = 2
+        elif prefix_match:
+            rank = 1
+        else:
+            rank = 0
+
+        return rank + self._similarity(w_id)
@@ -0,0 +1,60 @@
+import math
+
+class SpatialGrid:
+    """Uniform grid over world coordinates, used to find the points (players) near a rectangle without checking all of them"""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+
+        self.cells = {} # (cell x, cell y) -> set of items
+        self.items = {} # item -> cell it's in
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def move_point(self, item, x, y):
+        cell = self._cell(x, y)
+
+        # Only touch the grid when the point actually crossed into another cell
+        if self.items.get(item) == cell:
+            return
+
+        self.remove(item)
+
+        self.items[item] = cell
+        self.cells.setdefault(cell, set()).add(item)
+
+    def remove(self, item):
+        cell = self.items.pop(item, None)
+
+        if cell is None:
+            return
+
+        cell_items = self.cells[cell]
+        cell_items.discard(item)
+
+        if not cell_items:
+            del self.cells[cell]
+
+    def query(self, min_x, min_y, max_x, max_y):
+        """Returns every item in a cell touched by the rectangle"""
+
+        min_cx, min_cy = self._cell(min_x, min_y)
+        max_cx, max_cy = self._cell(max_x, max_y)
+
+        result = set()
+
+        # Pick whichever is cheaper: looking up every cell in the rectangle, or checking every occupied cell
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) <= len(self.cells):
+            for cx in range(min_cx, max_cx + 1):
+                for cy in range(min_cy, max_cy + 1):
+                    cell_items = self.cells.get((cx, cy))
+
+                    if cell_items is not None:
+                        result.update(cell_items)
+        else:
+            for (cx, cy), cell_items in self.cells.items():
+                if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy:
+                    result.update(cell_items)
+
+        return result
@@ -0,0 +1,49 @@
+import argparse
+import email.utils
+import hashlib
+import http.server
+import os
+
+# Stand-in for the AirCS map's stations.json, for testing pull_data.py without the real server.
+# Serves a local file, read again on every request so editing it looks like an update, and answers
+# conditional requests with 304 Not Modified like the real server would.
+
+parser = argparse.ArgumentParser(description="Serve a local stations.json over HTTP, with ETag and Last-Modified")
+parser.add_argument("path", help="stations.json to serve")
+parser.add_argument("--host", default="localhost")
+parser.add_argument("--port", type=int, default=8000)
+parser.add_argument("--no-etag", action="store_true", help="only send Last-Modified, to test servers without ETags")
+args = parser.parse_args()
+
+class StationsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        with open(args.path, "rb") as f:
+            body = f.read()
+
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        last_modified = email.utils.formatdate(os.path.getmtime(args.path), usegmt=True)
+
+        if args.no_etag:
+            not_modified = self.headers.get("If-Modified-Since") == last_modified
+        else:
+            not_modified = self.headers.get("If-None-Match") == etag
+
+        self.send_response(304 if not_modified else 200)
+
+        if not args.no_etag:
+            self.send_header("ETag", etag)
+
+        self.send_header("Last-Modified", last_modified)
+
+        if not_modified:
+            self.end_headers()
+            return
+
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+server = http.server.ThreadingHTTPServer((args.host, args.port), StationsHandler)
+print("Serving %s on http://%s:%d/" % (args.path, args.host, args.port))
+server.serve_forever()